@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""Concurrency check/benchmark for TransferEngine on a fake object store
+
+Uploads objects to a fake S3 (e.g. moto server) and GCS (e.g. fake-gcs-server),
+transfers them with a thread pool (cloud -> local, cloud -> cloud) and
+checks that every target has the same md5 as its source and
+that each worker thread used its own storage client.
+
+Usage:
+    export AWS_ENDPOINT_URL=http://127.0.0.1:5000
+    export STORAGE_EMULATOR_HOST=http://localhost:4443
+    python benchmarks/bench_concurrent_transfer.py [NUM_FILES] [NUM_WORKERS]
+
+Either of AWS_ENDPOINT_URL or STORAGE_EMULATOR_HOST can be omitted.
+Never run it against real buckets.
+"""
+
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import croo
+except:
+    script_path = os.path.dirname(os.path.realpath(__file__))
+    sys.path.append(os.path.join(script_path, '../'))
+    import croo
+from autouri import GCSURI, S3URI
+from croo import cloud_copy
+from croo.object_index import ObjectIndex
+from croo.transfer import Transfer, TransferEngine
+
+
+SRC_BUCKET = 'croo-bench-src'
+DEST_BUCKET = 'croo-bench-dest'
+
+
+def make_buckets(scheme):
+    if scheme == 's3':
+        cl = cloud_copy.get_s3_client()
+        for b in (SRC_BUCKET, DEST_BUCKET):
+            try:
+                cl.create_bucket(Bucket=b)
+            except cl.exceptions.BucketAlreadyOwnedByYou:
+                pass
+    else:
+        from google.api_core.exceptions import Conflict
+        cl = cloud_copy.get_gcs_client()
+        for b in (SRC_BUCKET, DEST_BUCKET):
+            try:
+                cl.create_bucket(b)
+            except Conflict:
+                pass
+
+
+def upload(scheme, key, data):
+    if scheme == 's3':
+        cloud_copy.get_s3_client().put_object(
+            Bucket=SRC_BUCKET, Key=key, Body=data)
+    else:
+        cloud_copy.get_gcs_client().bucket(SRC_BUCKET).blob(
+            key).upload_from_string(data)
+
+
+def download(uri):
+    if uri.startswith('s3://'):
+        bucket, key = cloud_copy.split_bucket_key(uri)
+        return cloud_copy.get_s3_client().get_object(
+            Bucket=bucket, Key=key)['Body'].read()
+    elif uri.startswith('gs://'):
+        bucket, key = cloud_copy.split_bucket_key(uri)
+        return cloud_copy.get_gcs_client().bucket(bucket).blob(
+            key).download_as_bytes()
+    if not os.path.exists(uri):
+        return b''
+    with open(uri, 'rb') as fp:
+        return fp.read()
+
+
+def get_num_cached_clients():
+    return len(S3URI._CACHED_BOTO3_CLIENTS) + \
+        len(GCSURI._CACHED_GCS_CLIENTS)
+
+
+def run(scheme, num_files, num_workers, out_dir):
+    make_buckets(scheme)
+    md5s = {}
+    transfers = []
+    for i in range(num_files):
+        data = os.urandom(1024 + i)
+        key = 'call-task/shard-{}/out.txt'.format(i)
+        upload(scheme, key, data)
+        src = '{}://{}/{}'.format(scheme, SRC_BUCKET, key)
+        md5s[src] = hashlib.md5(data).hexdigest()
+        transfers.append(Transfer(
+            source=src,
+            target=os.path.join(out_dir, scheme, key),
+            method='copy'))
+        transfers.append(Transfer(
+            source=src,
+            target='{}://{}/{}'.format(scheme, DEST_BUCKET, key),
+            method='copy'))
+
+    index = ObjectIndex(num_threads=num_workers)
+    index.add(t.source for t in transfers)
+    index.add(t.target for t in transfers)
+    engine = TransferEngine(
+        num_workers=num_workers, index=index, make_md5_file=False)
+
+    num_clients = get_num_cached_clients()
+    threads = set()
+    lock = threading.Lock()
+    if scheme == 's3':
+        cls, name = S3URI, 'get_boto3_client'
+    else:
+        cls, name = GCSURI, 'get_gcs_client'
+    orig_get_client = getattr(cls, name)
+
+    def get_client(thread_id=-1):
+        with lock:
+            threads.add((threading.get_ident(), thread_id))
+        return orig_get_client(thread_id)
+
+    setattr(cls, name, staticmethod(get_client))
+    try:
+        t0 = time.perf_counter()
+        results = engine.run(transfers)
+        elapsed = time.perf_counter() - t0
+    finally:
+        setattr(cls, name, staticmethod(orig_get_client))
+
+    errors = [r.error for r in results if r.error is not None]
+    mismatched = [
+        t.target for t in transfers
+        if hashlib.md5(download(t.target)).hexdigest() != md5s[t.source]]
+    shared = [(i, j) for i, j in threads if i != j]
+    print('{s}: {n} transfers in {t:.3f} sec, {e} errors, {m} mismatched, '
+          '{c} new clients, {sh} calls on a client of another thread'.format(
+              s=scheme, n=len(transfers), t=elapsed, e=len(errors),
+              m=len(mismatched), c=get_num_cached_clients() - num_clients,
+              sh=len(shared)))
+    return not errors and not mismatched and not shared
+
+
+def main():
+    num_files = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    num_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+
+    schemes = []
+    if os.environ.get('AWS_ENDPOINT_URL'):
+        schemes.append('s3')
+    if os.environ.get('STORAGE_EMULATOR_HOST'):
+        schemes.append('gs')
+    if not schemes:
+        print('Define AWS_ENDPOINT_URL or STORAGE_EMULATOR_HOST '
+              'for a fake object store.')
+        sys.exit(1)
+
+    ok = True
+    with tempfile.TemporaryDirectory() as out_dir:
+        for scheme in schemes:
+            ok = run(scheme, num_files, num_workers, out_dir) and ok
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
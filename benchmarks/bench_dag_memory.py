@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Memory benchmark: DAG (dict of sets) vs. CompactDAG (CSR arrays)
+
+Builds a task graph with synthetic CMNodes mimicking a scattered pipeline
+(each task's shard consumes outputs of the previous task's shard)
+and measures memory retained by each graph with tracemalloc.
+
+Usage:
+    python benchmarks/bench_dag_memory.py [NUM_TASKS] [NUM_SHARDS]
+"""
+
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+try:
+    import croo
+except:
+    script_path = os.path.dirname(os.path.realpath(__file__))
+    sys.path.append(os.path.join(script_path, '../'))
+    import croo
+from croo.compact_dag import CompactDAG
+from croo.cromwell_metadata import (
+    CMNode, get_keys_as_child_cmnode, get_keys_as_parent_cmnode)
+from croo.dag import DAG
+
+
+def make_nodes(num_tasks, num_shards):
+    prev_outputs = [
+        ('fastq', '/data/rep{}.fastq.gz'.format(i), (i,))
+        for i in range(num_shards)]
+    for t in range(num_tasks):
+        task_name = 'pipeline.task{}'.format(t)
+        outputs = []
+        for i in range(num_shards):
+            out_dir = '/cromwell/pipeline/call-task{}/shard-{}/'.format(t, i)
+            all_outputs = (
+                ('out', out_dir + 'out.bam', (-1,)),
+                ('log', out_dir + 'out.log', (-1,)))
+            yield CMNode(
+                type='task', shard_idx=(i,), task_name=task_name,
+                output_name=None, output_path=None,
+                all_outputs=all_outputs,
+                all_inputs=(prev_outputs[i],))
+            for output_name, output_path, _ in all_outputs:
+                yield CMNode(
+                    type='output', shard_idx=(i,), task_name=task_name,
+                    output_name=output_name, output_path=output_path,
+                    all_outputs=None, all_inputs=None)
+            outputs.append(all_outputs[0])
+        prev_outputs = outputs
+
+
+def measure(dag_cls, num_tasks, num_shards):
+    gc.collect()
+    tracemalloc.start()
+    t = time.time()
+    dag = dag_cls.from_nodes(
+        make_nodes(num_tasks, num_shards),
+        fnc_keys_as_parent=get_keys_as_parent_cmnode,
+        fnc_keys_as_child=get_keys_as_child_cmnode)
+    elapsed = time.time() - t
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del dag
+    return elapsed, current, peak
+
+
+def main():
+    num_tasks = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    num_shards = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    print('num_nodes={}'.format(num_tasks * num_shards * 3))
+    print('backend\tbuild_sec\tretained_MB\tpeak_MB')
+    for dag_cls in (DAG, CompactDAG):
+        elapsed, current, peak = measure(dag_cls, num_tasks, num_shards)
+        print('{}\t{:.2f}\t{:.1f}\t{:.1f}'.format(
+            dag_cls.__name__, elapsed, current / 1024**2, peak / 1024**2))
+
+
+if __name__ == '__main__':
+    main()
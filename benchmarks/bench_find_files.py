@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""Benchmark for finding files in call outputs (find_files_in_dict)
+
+Makes call outputs with a large scatter-gathered Array[Array[File]]
+and measures time and peak memory of finding all files in them.
+
+Usage:
+    python benchmarks/bench_find_files.py [NUM_ROWS] [NUM_COLS]
+"""
+
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+try:
+    import croo
+except:
+    script_path = os.path.dirname(os.path.realpath(__file__))
+    sys.path.append(os.path.join(script_path, '../'))
+    import croo
+from croo.cromwell_metadata import find_files_in_dict, is_valid_uri
+
+
+def make_outputs(num_rows, num_cols):
+    return {
+        'bams': [
+            ['/cromwell/pipeline/call-gather/shard-{}/rep{}.bam'.format(i, j)
+             for j in range(num_cols)]
+            for i in range(num_rows)],
+        'sample_names': ['sample{}'.format(i) for i in range(num_rows)],
+        'num_reads': [[j for j in range(num_cols)] for i in range(num_rows)],
+    }
+
+
+def measure(outputs):
+    is_valid_uri.cache_clear()
+    gc.collect()
+    tracemalloc.start()
+    t = time.time()
+    files = find_files_in_dict(outputs)
+    elapsed = time.time() - t
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(files), elapsed, peak
+
+
+def main():
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    num_cols = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    outputs = make_outputs(num_rows, num_cols)
+
+    num_files, elapsed, peak = measure(outputs)
+    print('Array[Array[File]] {}x{}'.format(num_rows, num_cols))
+    print('num_files\tsec\tpeak_MB')
+    print('{}\t{:.3f}\t{:.1f}'.format(num_files, elapsed, peak / 1024**2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""Benchmark for cold-start time of croo's entry points
+
+Runs each entry point in a fresh Python process.
+Import time of a module is taken from "python -X importtime" and
+wall time of CLI commands (croo --version, croo --help) is also measured.
+
+Usage:
+    python benchmarks/bench_import_time.py [NUM_REPEATS]
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+
+# module imported by each entry point
+MODULES = ('croo', 'croo.cli', 'croo.cromwell_metadata', 'croo.croo')
+CLI_ARGS = (('--version',), ('--help',))
+
+
+def run(args):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT_DIR] + [p for p in env.get('PYTHONPATH', '').split(os.pathsep) if p])
+    return subprocess.run(
+        [sys.executable] + list(args), env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True)
+
+
+def get_import_time_us(module):
+    """Cumulative import time of a module in microseconds.
+    """
+    p = run(['-X', 'importtime', '-c', 'import {}'.format(module)])
+    for line in p.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        cols = line.split('|')
+        if len(cols) == 3 and cols[2].strip() == module:
+            return int(cols[1])
+    return None
+
+
+def get_wall_time_sec(args):
+    t = time.time()
+    run(['-m', 'croo'] + list(args))
+    return time.time() - t
+
+
+def main():
+    num_repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    print('entry_point\tmin_ms')
+    for module in MODULES:
+        us = min(get_import_time_us(module) for _ in range(num_repeats))
+        print('import {}\t{:.1f}'.format(module, us / 1000))
+    for args in CLI_ARGS:
+        sec = min(get_wall_time_sec(args) for _ in range(num_repeats))
+        print('croo {}\t{:.1f}'.format(' '.join(args), sec * 1000))
+
+
+if __name__ == '__main__':
+    main()
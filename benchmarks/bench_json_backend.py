@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""Benchmark for JSON backends: decode time and peak memory
+
+Writes a synthetic Cromwell metadata JSON file (scattered tasks with
+inputs, outputs, executionEvents, callCaching and runtimeAttributes)
+and decodes it with each installed JSON backend.
+
+Usage:
+    python benchmarks/bench_json_backend.py [NUM_TASKS] [NUM_SHARDS]
+"""
+
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import croo
+except:
+    script_path = os.path.dirname(os.path.realpath(__file__))
+    sys.path.append(os.path.join(script_path, '../'))
+    import croo
+from croo import json_backend
+
+
+def make_metadata(num_tasks, num_shards):
+    calls = {}
+    prev_outputs = ['/data/rep{}.fastq.gz'.format(i) for i in range(num_shards)]
+    for t in range(num_tasks):
+        call_list = []
+        outputs = []
+        for i in range(num_shards):
+            out_dir = '/cromwell/pipeline/call-task{}/shard-{}/'.format(t, i)
+            call_list.append({
+                'shardIndex': i,
+                'executionStatus': 'Done',
+                'inputs': {'bam': prev_outputs[i], 'cpu': 4, 'mem_mb': 8000.5},
+                'outputs': {'out': out_dir + 'out.bam', 'log': out_dir + 'out.log'},
+                'runtimeAttributes': {'cpu': '4', 'memory': '8000 MB', 'docker': 'ubuntu'},
+                'callCaching': {'allowResultReuse': True, 'hit': False, 'result': 'Cache Miss'},
+                'executionEvents': [
+                    {'startTime': '2020-01-01T00:00:00.000Z',
+                     'endTime': '2020-01-01T00:00:01.000Z',
+                     'description': 'event{}'.format(e)} for e in range(10)],
+                'backendLogs': {'log': out_dir + 'execution.log'},
+            })
+            outputs.append(out_dir + 'out.bam')
+        calls['pipeline.task{}'.format(t)] = call_list
+        prev_outputs = outputs
+    return {
+        'id': 'f0000000-0000-0000-0000-000000000000',
+        'submittedFiles': {
+            'inputs': json.dumps({'pipeline.fastqs': prev_outputs}),
+            'workflow': 'workflow pipeline {}'},
+        'calls': calls}
+
+
+def main():
+    num_tasks = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    num_shards = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        f = os.path.join(tmp_dir, 'metadata.json')
+        with open(f, 'w') as fp:
+            json.dump(make_metadata(num_tasks, num_shards), fp)
+        print('metadata_size_MB={:.1f}'.format(os.path.getsize(f) / 1024**2))
+        print('backend\tdecode_sec\tpeak_MB')
+
+        for backend in json_backend.get_available_backends():
+            json_backend.set_backend(backend)
+            gc.collect()
+            tracemalloc.start()
+            t = time.time()
+            d = json_backend.load_file(f)
+            elapsed = time.time() - t
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del d
+            print('{}\t{:.2f}\t{:.1f}'.format(backend, elapsed, peak / 1024**2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Benchmark for local-to-local copy: wall time and CPU time
+
+Writes a random file of each size and copies it with
+    - python: read/write with Python-level 1MB buffers
+    - shutil: shutil.copyfile (autouri's local copy)
+    - kernel: croo.local_copy.copy_file with a single thread
+    - kernel_parallel: croo.local_copy.copy_file with NUM_THREADS threads
+CPU time is user+sys time of this process (all threads).
+Page cache is not dropped between runs.
+
+Usage:
+    python benchmarks/bench_local_copy.py [SIZE_GB ...] [--dir DIR]
+    e.g. python benchmarks/bench_local_copy.py 1 50 --dir /scratch/tmp
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    import croo
+except:
+    script_path = os.path.dirname(os.path.realpath(__file__))
+    sys.path.append(os.path.join(script_path, '../'))
+    import croo
+from croo import local_copy
+
+
+def make_file(f, size, block_size=64 * 1024 * 1024):
+    block = os.urandom(min(block_size, size))
+    with open(f, 'wb') as fp:
+        written = 0
+        while written < size:
+            n = min(len(block), size - written)
+            fp.write(block[:n])
+            written += n
+
+
+def copy_python(source, target):
+    with open(source, 'rb') as fsrc, open(target, 'wb') as fdst:
+        shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+
+
+def copy_kernel(source, target):
+    local_copy.copy_file(source, target, num_threads=1)
+
+
+def copy_kernel_parallel(source, target):
+    local_copy.copy_file(source, target)
+
+
+METHODS = (
+    ('python', copy_python),
+    ('shutil', shutil.copyfile),
+    ('kernel', copy_kernel),
+    ('kernel_parallel', copy_kernel_parallel),
+)
+
+
+def main():
+    args = sys.argv[1:]
+    work_dir = None
+    if '--dir' in args:
+        i = args.index('--dir')
+        work_dir = args[i + 1]
+        del args[i:i + 2]
+    sizes_gb = [float(s) for s in args] or [1.0]
+
+    print('size_GB\tmethod\twall_sec\tcpu_sec\tGB_per_sec')
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp_dir:
+        for size_gb in sizes_gb:
+            size = int(size_gb * 1024**3)
+            source = os.path.join(tmp_dir, 'source.bin')
+            make_file(source, size)
+
+            for name, fnc in METHODS:
+                target = os.path.join(tmp_dir, 'target.bin')
+                cpu = os.times()
+                t = time.time()
+                fnc(source, target)
+                elapsed = time.time() - t
+                cpu_ = os.times()
+                cpu_time = (cpu_.user - cpu.user) + (cpu_.system - cpu.system)
+                if os.path.getsize(target) != size:
+                    raise ValueError('Wrong size of a copy. {}'.format(name))
+                os.remove(target)
+                print('{}\t{}\t{:.2f}\t{:.2f}\t{:.2f}'.format(
+                    size_gb, name, elapsed, cpu_time,
+                    size_gb / elapsed if elapsed else 0.0))
+            os.remove(source)
+
+
+if __name__ == '__main__':
+    main()
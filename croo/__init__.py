@@ -1,4 +1,12 @@
-from .croo import Croo
+__version__ = '0.4.2.1'
 
 
-__version__ = '0.4.2.1'
+def __getattr__(name):
+    """Import Croo lazily so that croo's CLI (e.g. croo --version)
+    does not import heavy dependencies (autouri, graphviz, ...) on startup.
+    """
+    if name == 'Croo':
+        from .croo import Croo
+        return Croo
+    raise AttributeError(
+        'module {m} has no attribute {a}'.format(m=__name__, a=name))
@@ -3,8 +3,7 @@ import csv
 import logging
 import os
 import sys
-from autouri import S3URI, GCSURI
-from .croo import Croo
+from . import json_backend
 from . import __version__ as version
 
 
@@ -14,7 +13,8 @@ def parse_croo_arguments():
     p = argparse.ArgumentParser()
     p.add_argument(
         'metadata_json',
-        help='Path, URL or URI for metadata.json for a workflow '
+        help='Path, URL or URI for metadata.json for a workflow. '
+             'Compressed file (gzip, bzip2, xz or zstd) is also allowed. '
              'Example: /scratch/sample1/metadata.json, '
              'gs://some/where/metadata.json, '
              'http://hello.com/world/metadata.json')
@@ -23,12 +23,18 @@ def parse_croo_arguments():
         help='Output definition JSON file for a WDL file corresponding to '
              'the specified metadata.json file')
     p.add_argument(
-        '--method', choices=('link', 'copy'), default='link',
+        '--method', choices=('link', 'copy', 'hardlink', 'reflink'),
+        default='link',
         help='Method to localize files on output directory/bucket. '
         '"link" means a soft-linking and it\'s for local directory only. '
         'Original output files will be kept in Cromwell\'s output '
         'directory. '
-        '"copy" makes copies of Cromwell\'s original outputs')
+        '"copy" makes copies of Cromwell\'s original outputs. '
+        '"hardlink" makes hard links (local directory on the same '
+        'filesystem only) which survive removal of Cromwell\'s outputs. '
+        '"reflink" makes copy-on-write clones without copying data '
+        '(local directory on Linux btrfs/XFS only). '
+        'Both "hardlink" and "reflink" fall back to "copy" if not possible')
     p.add_argument(
         '--ucsc-genome-db',
         help='UCSC genome browser\'s "db=" parameter. '
@@ -54,12 +60,12 @@ def parse_croo_arguments():
              'presigned URLs on files on gs://.')
     p.add_argument(
         '--duration-presigned-url-s3', type=int,
-        default=S3URI.DURATION_PRESIGNED_URL,
-        help='Duration for presigned URLs for files on s3:// in seconds. ')
+        help='Duration for presigned URLs for files on s3:// in seconds. '
+             'Autouri\'s default duration is used if not defined.')
     p.add_argument(
         '--duration-presigned-url-gcs', type=int,
-        default=GCSURI.DURATION_PRESIGNED_URL,
-        help='Duration for presigned URLs for files on gs:// in seconds. ')
+        help='Duration for presigned URLs for files on gs:// in seconds. '
+             'Autouri\'s default duration is used if not defined.')
     p.add_argument(
         '--tsv-mapping-path-to-url',
         help='A 2-column TSV file with local path prefix and corresponding '
@@ -87,6 +93,77 @@ def parse_croo_arguments():
         help='Always overwrite on output directory/bucket (--out-dir) '
              'even if md5-identical files (or soft links) already exist there. '
              'Md5 hash/filename/filesize checking will be skipped.')
+    p.add_argument(
+        '--num-workers', type=int, default=1,
+        help='Number of threads to link/copy files in parallel. '
+             'Useful for a workflow with many outputs on cloud buckets. '
+             'Failure of a file does not stop others and all failed files '
+             'are reported at the end.')
+    p.add_argument(
+        '--no-journal', action='store_true',
+        help='Do not use/write a journal of completed transfers on --tmp-dir. '
+             'By default, croo records each completed transfer in '
+             'croo.journal.[WORKFLOW_ID].jsonl and an interrupted run '
+             'resumes from there. Journal is removed after all transfers '
+             'are done.')
+    p.add_argument(
+        '--manifest', action='store_true',
+        help='Use/write a manifest of transferred files on --out-dir. '
+             'Croo writes croo.manifest.[WORKFLOW_ID].json with '
+             'size/mtime of all source files at the end and a next run '
+             'into the same --out-dir transfers new or changed files only '
+             'without checking md5 of all files.')
+    p.add_argument(
+        '--dedup', action='store_true',
+        help='For --method copy, copy files with the same contents '
+             '(same source, same inode or same md5 on a cloud bucket) only '
+             'once and make other copies from there. On local storage, '
+             'other copies are hard links to the first copy so that '
+             'modifying one of them in place modifies all of them.')
+    p.add_argument(
+        '--checksums-tsv', action='store_true',
+        help='Write size/md5/crc32c of all organized files to a single '
+             'croo.checksums.[WORKFLOW_ID].tsv on --out-dir instead of '
+             'letting autouri write an .md5 file next to a copied file. '
+             'A next run skips copying a file from a cloud bucket if md5 in '
+             'its metadata matches the one in it. md5 of a local file is '
+             'calculated only if it has changed since the last run.')
+    p.add_argument(
+        '--dry-run', action='store_true',
+        help='Do not transfer any files. Write a plan of all transfers '
+             '(source, target, method, size and annotations for a report) '
+             'to croo.plan.[WORKFLOW_ID].json and .tsv on --out-dir.')
+    p.add_argument(
+        '--plan-json',
+        help='Execute a plan JSON file written by --dry-run instead of '
+             'making a new one. It can be a subset of an original plan. '
+             'Subsets can run at the same time. Report is not written for '
+             'a subset and manifest/checksums are written to separate files '
+             'per subset. Run with a full plan after all subsets are done '
+             'to merge them and write a report.')
+    p.add_argument(
+        '--compact-task-graph', action='store_true',
+        help='Use a compact read-only task graph to save memory. '
+             'Useful for a huge metadata JSON file with 100k+ tasks/outputs.')
+    p.add_argument(
+        '--metadata-cache', action='store_true',
+        help='Cache a task graph parsed from metadata JSON file on --tmp-dir '
+             'and re-use it for the same metadata JSON file. '
+             'Cache is keyed by md5 hash of metadata JSON file so that '
+             'the whole file is read once more for it. Useful if croo is '
+             'run many times for a huge metadata JSON file.')
+    p.add_argument(
+        '--stream-metadata', action='store_true',
+        help='Parse metadata JSON file incrementally and keep only what '
+             'croo needs. Use this for a huge metadata JSON file (> 1GB) '
+             'to reduce memory usage. Requires ijson (pip install ijson).')
+    p.add_argument(
+        '--json-backend',
+        choices=(json_backend.JSON_BACKEND_AUTO,) + json_backend.JSON_BACKENDS,
+        default=json_backend.JSON_BACKEND_AUTO,
+        help='JSON decoder for metadata/out_def JSON files. '
+             '"auto" uses the fastest installed one '
+             '(orjson > ujson > json).')
     p.add_argument('-v', '--version', action='store_true',
                    help='Show version')
     p.add_argument('-D', '--debug', action='store_true',
@@ -117,6 +194,8 @@ def check_args(args):
         raise ValueError(
             'Define --gcp-private-key to use presigned URLs on GCS'
             ' (--use-presigned-url-gcs).')
+    if args['num_workers'] < 1:
+        raise ValueError('--num-workers must be >= 1.')
 
     if args['public_gcs'] and args['use_presigned_url_gcs']:
         raise ValueError(
@@ -164,6 +243,14 @@ def init_autouri(args):
         args:
             dict of cmd line arguments
     """
+    # autouri imports cloud SDKs so import it only when required
+    from autouri import S3URI, GCSURI
+
+    if args['duration_presigned_url_s3'] is None:
+        args['duration_presigned_url_s3'] = S3URI.DURATION_PRESIGNED_URL
+    if args['duration_presigned_url_gcs'] is None:
+        args['duration_presigned_url_gcs'] = GCSURI.DURATION_PRESIGNED_URL
+
     GCSURI.init_gcsuri(
         use_gsutil_for_s3=args['use_gsutil_for_s3'])
 
@@ -195,10 +282,14 @@ def init_logging(args):
 def main():
     args = parse_croo_arguments()
 
+    from .croo import Croo
+    from .transfer_plan import load_plan_json
+
     check_args(args)
     init_dirs(args)
     init_autouri(args)
     init_logging(args)
+    json_backend.set_backend(args['json_backend'])
 
     co = Croo(
         metadata_json=args['metadata_json'],
@@ -215,9 +306,22 @@ def main():
         public_gcs=args['public_gcs'],
         gcp_private_key=args['gcp_private_key'],
         map_path_to_url=args['mapping_path_to_url'],
-        no_checksum=args['no_checksum'])
+        no_checksum=args['no_checksum'],
+        compact_task_graph=args['compact_task_graph'],
+        use_metadata_cache=args['metadata_cache'],
+        stream_metadata=args['stream_metadata'],
+        num_workers=args['num_workers'],
+        use_journal=not args['no_journal'],
+        use_manifest=args['manifest'],
+        method=args['method'],
+        dedup=args['dedup'],
+        use_checksums=args['checksums_tsv'])
 
-    co.organize_output()
+    if args['plan_json'] is None:
+        plan = None
+    else:
+        plan = load_plan_json(args['plan_json'], tmp_dir=args['tmp_dir'])
+    co.organize_output(dry_run=args['dry_run'], plan=plan)
 
     return 0
 
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""Cloud-to-cloud copy without local staging.
+    gs:// -> gs://: server-side rewrite (resumed with a rewrite token).
+    s3:// -> s3://: server-side (multipart) copy.
+    gs:// <-> s3://: piped streaming from source to target in chunks.
+                     No temporary file on local storage.
+Not used if autouri is set to use gsutil (--use-gsutil-for-s3).
+
+Clients are made per thread from default credentials
+(same as autouri). They can also talk to a fake object store for testing:
+    S3: environment variable AWS_ENDPOINT_URL (e.g. moto server)
+    GCS: environment variable STORAGE_EMULATOR_HOST (e.g. fake-gcs-server)
+
+Author:
+    Jin Lee (leepc12@gmail.com) at ENCODE-DCC
+"""
+
+import shutil
+import threading
+from autouri import AutoURI, GCSURI, S3URI
+
+
+# chunk size for streaming between providers
+CHUNK_SIZE = 64 * 1024 * 1024
+
+_local = threading.local()
+
+
+def get_gcs_client():
+    """Get a GCS client for the current thread.
+    GCS client is not thread-safe.
+    Error is raised if default credentials are not found.
+    """
+    cl = getattr(_local, 'gcs_client', None)
+    if cl is None:
+        from google.cloud import storage
+        cl = storage.Client()
+        _local.gcs_client = cl
+    return cl
+
+
+def get_s3_client():
+    """Get a boto3 S3 client for the current thread.
+    """
+    cl = getattr(_local, 's3_client', None)
+    if cl is None:
+        import boto3
+        cl = boto3.session.Session().client('s3')
+        _local.s3_client = cl
+    return cl
+
+
+def split_bucket_key(uri):
+    """Split gs://BUCKET/KEY or s3://BUCKET/KEY into (BUCKET, KEY).
+    """
+    _, _, bucket, key = uri.split('/', 3)
+    return bucket, key
+
+
+def is_cloud_to_cloud(source, target):
+    """Check if a file can be copied with copy_object().
+    False if autouri is set to use gsutil (--use-gsutil-for-s3)
+    so that such setup is still used by autouri.
+    """
+    if GCSURI.USE_GSUTIL_FOR_S3:
+        return False
+    return isinstance(AutoURI(source), (GCSURI, S3URI)) and \
+        isinstance(AutoURI(target), (GCSURI, S3URI))
+
+
+def is_same_object(source, target, index=None):
+    """Check if target is already a copy of source with metadata only.
+    Same rule as AutoURI.cp(): md5 matched or
+    name/size matched and source is not newer.
+
+    Args:
+        index:
+            ObjectIndex to look up metadata without a request per object.
+    """
+    from .object_index import get_metadata
+
+    m_target = get_metadata(target, index)
+    if not m_target.exists:
+        return False
+    m_source = get_metadata(source, index)
+    if m_source.md5 is not None and m_source.md5 == m_target.md5:
+        return True
+    return source.rsplit('/', 1)[-1] == target.rsplit('/', 1)[-1] \
+        and m_source.size is not None and m_source.size == m_target.size \
+        and m_source.mtime is not None and m_target.mtime is not None \
+        and m_source.mtime <= m_target.mtime
+
+
+def copy_object(source, target, no_checksum=False, index=None):
+    """Copy an object between cloud buckets (gs://, s3://).
+    Data is never written to local storage.
+
+    Args:
+        no_checksum:
+            Always copy. Otherwise skip if target is already a copy of source.
+        index:
+            ObjectIndex. See is_same_object().
+    Returns:
+        target
+    """
+    if not no_checksum and is_same_object(source, target, index):
+        return target
+
+    src_bucket, src_key = split_bucket_key(source)
+    dest_bucket, dest_key = split_bucket_key(target)
+    src_is_gcs = isinstance(AutoURI(source), GCSURI)
+    dest_is_gcs = isinstance(AutoURI(target), GCSURI)
+
+    if src_is_gcs and dest_is_gcs:
+        cl = get_gcs_client()
+        src_blob = cl.bucket(src_bucket).blob(src_key)
+        dest_blob = cl.bucket(dest_bucket).blob(dest_key)
+        # a large object can take multiple rewrite calls
+        token, _, _ = dest_blob.rewrite(src_blob)
+        while token is not None:
+            token, _, _ = dest_blob.rewrite(src_blob, token=token)
+
+    elif not src_is_gcs and not dest_is_gcs:
+        # managed copy: server-side multipart copy for a large object
+        get_s3_client().copy(
+            CopySource={'Bucket': src_bucket, 'Key': src_key},
+            Bucket=dest_bucket,
+            Key=dest_key)
+
+    elif src_is_gcs:
+        src_blob = get_gcs_client().bucket(src_bucket).blob(src_key)
+        with src_blob.open('rb', chunk_size=CHUNK_SIZE) as fp:
+            get_s3_client().upload_fileobj(fp, dest_bucket, dest_key)
+
+    else:
+        body = get_s3_client().get_object(
+            Bucket=src_bucket, Key=src_key)['Body']
+        dest_blob = get_gcs_client().bucket(dest_bucket).blob(dest_key)
+        try:
+            with dest_blob.open('wb', chunk_size=CHUNK_SIZE) as fp:
+                shutil.copyfileobj(body, fp, CHUNK_SIZE)
+        finally:
+            body.close()
+
+    return target
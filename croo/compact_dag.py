@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""Read-only DAG with a compact memory layout.
+Same query API as DAG (get_nodes, find_nodes, to_dot, ...)
+but uses much less memory for a huge graph.
+
+Author:
+    Jin Lee (leepc12@gmail.com) at ENCODE-DCC
+"""
+
+from array import array
+from .dag import DAG
+
+
+class CompactDAG(DAG):
+    """Read-only directed acyclic graph with a compact memory layout.
+
+    Each node gets a dense integer id (0, 1, 2, ...) in the order of insertion
+    and this id is used as a hash of a node (h) in all public methods.
+
+    Links are stored as two compressed sparse row (CSR) arrays.
+    Nodes are stored column-wise if all nodes are namedtuples of the same type.
+    Equal attribute values (e.g. task names, shard indices) are stored once.
+
+    Args:
+        nodes:
+            list of nodes. index in the list is an integer id of a node.
+        children:
+            list of iterables of children ids. children[i] is for i-th node.
+        indexed_attrs (optional):
+            tuple of names of nodes' attributes to be indexed.
+            See DAG.find_nodes_by_attrs() for details.
+
+    Member variables:
+        self._node_type:
+            namedtuple type of nodes. None if nodes are not namedtuples.
+        self._columns:
+            [[val_node0, val_node1, ...], ...] for each field of namedtuple.
+        self._node_list:
+            list of nodes if nodes are not namedtuples. Otherwise None.
+        self._child_ptr, self._child_ids:
+            children of node i are
+            self._child_ids[self._child_ptr[i]:self._child_ptr[i+1]]
+        self._parent_ptr, self._parent_ids:
+            parents of node i are
+            self._parent_ids[self._parent_ptr[i]:self._parent_ptr[i+1]]
+        self._attr_index:
+            { attr: { val: [h1, h2, ...] } } for each attr in indexed_attrs.
+        self._node_ids:
+            { n: h } made on the first call of hash_node().
+
+    All mutators of DAG (add_node, add_nodes, rm_node, rm_nodes) raise
+    TypeError.
+    """
+    TYPECODE_PTR = 'q'
+    TYPECODE_ID = 'I'
+
+    def __init__(self, nodes, children, indexed_attrs=None):
+        nodes = list(nodes)
+        self._num_nodes = len(nodes)
+        self._fnc_hash = None
+        self._node_ids = None
+        self.__init_columns(nodes)
+        self.__init_csr(children)
+        self.__init_attr_index(indexed_attrs)
+
+    @classmethod
+    def from_dag(cls, dag):
+        """Freeze a DAG into a CompactDAG.
+        Hashes of nodes in the original DAG are replaced with integer ids.
+        """
+        ids = {}
+        nodes = []
+        for h, n in dag.get_nodes():
+            ids[h] = len(nodes)
+            nodes.append(n)
+        children = [
+            [ids[h_child] for h_child in dag.get_children(h)]
+            for h, _ in dag.get_nodes()]
+        return cls(nodes, children, indexed_attrs=dag._indexed_attrs)
+
+    @classmethod
+    def from_nodes(cls, nodes, fnc_is_parent=None, fnc_hash=None,
+                   fnc_keys_as_parent=None, fnc_keys_as_child=None,
+                   indexed_attrs=None, check_cycle=False):
+        """Construct a CompactDAG from nodes without making an
+        intermediate DAG. Arguments are the same as DAG.from_nodes().
+        Nodes with the same hash are merged and the last one is taken.
+        """
+        ids = {}
+        node_list = []
+        for n in nodes:
+            h = hash(n) if fnc_hash is None else fnc_hash(n)
+            if h in ids:
+                node_list[ids[h]] = n
+            else:
+                ids[h] = len(node_list)
+                node_list.append(n)
+        ids = None
+
+        children = [set() for _ in node_list]
+        if fnc_keys_as_parent is not None and fnc_keys_as_child is not None:
+            parent_index = {}
+            for i, n in enumerate(node_list):
+                for key in set(fnc_keys_as_parent(n)):
+                    parent_index.setdefault(key, []).append(i)
+            for i, n in enumerate(node_list):
+                for key in set(fnc_keys_as_child(n)):
+                    for i_parent in parent_index.get(key, ()):
+                        if i_parent != i:
+                            children[i_parent].add(i)
+        elif fnc_is_parent is not None:
+            for i, n in enumerate(node_list):
+                for j, n_ in enumerate(node_list):
+                    if i != j and fnc_is_parent(n, n_):
+                        children[i].add(j)
+        else:
+            raise ValueError(
+                'Define fnc_is_parent or both fnc_keys_as_parent and '
+                'fnc_keys_as_child.')
+
+        dag = cls(node_list, children, indexed_attrs=indexed_attrs)
+        if check_cycle:
+            dag.topological_sort()
+        return dag
+
+    @classmethod
+    def from_edges(cls, nodes, edges, fnc_is_parent=None, fnc_hash=None,
+                   fnc_keys_as_parent=None, fnc_keys_as_child=None,
+                   indexed_attrs=None):
+        """Construct a CompactDAG with nodes and already known links.
+        Arguments are the same as DAG.from_edges().
+        """
+        nodes = list(nodes)
+        children = [[] for _ in nodes]
+        for i, j in edges:
+            children[i].append(j)
+        return cls(nodes, children, indexed_attrs=indexed_attrs)
+
+    def __str__(self):
+        result = '=== all nodes ===\n'
+        for h, n in self.get_nodes():
+            result += '{}: {}\n'.format(h, n)
+        result += '\n=== children ===\n'
+        for h in range(self._num_nodes):
+            result += '{}: {}\n'.format(h, list(self.get_children(h)))
+        return result
+
+    def hash_node(self, n):
+        """Find an integer id of a node. None if not found.
+        A dict of all nodes is made on the first call.
+        Nodes are scanned one by one if they are not hashable.
+        """
+        if self._node_ids is None:
+            try:
+                node_ids = {}
+                for h, n_ in self.get_nodes():
+                    node_ids.setdefault(n_, h)
+                self._node_ids = node_ids
+            except TypeError:
+                self._node_ids = False
+        if self._node_ids is False:
+            for h, n_ in self.get_nodes():
+                if n_ == n:
+                    return h
+            return None
+        try:
+            return self._node_ids.get(n)
+        except TypeError:
+            return None
+
+    def get_nodes(self):
+        """Get an iterator of all nodes.
+        Nodes are reconstructed from columns on the fly.
+
+        Returns:
+            iterator of (h, n) where h is an integer id of a node n
+        """
+        for h in range(self._num_nodes):
+            yield h, self.get_node(h)
+
+    def get_node(self, h):
+        if not 0 <= h < self._num_nodes:
+            return None
+        if self._node_list is not None:
+            return self._node_list[h]
+        return self._node_type._make(col[h] for col in self._columns)
+
+    def get_parents(self, h):
+        if not 0 <= h < self._num_nodes:
+            return ()
+        return self._parent_ids[self._parent_ptr[h]:self._parent_ptr[h + 1]]
+
+    def get_children(self, h):
+        if not 0 <= h < self._num_nodes:
+            return ()
+        return self._child_ids[self._child_ptr[h]:self._child_ptr[h + 1]]
+
+    def topological_sort(self):
+        """Sort all nodes in topological order (Kahn's algorithm).
+
+        Returns:
+            [h] where h is an integer id of a node.
+        Raises:
+            ValueError if graph has a cycle.
+        """
+        in_degree = array(
+            CompactDAG.TYPECODE_PTR,
+            (self._parent_ptr[h + 1] - self._parent_ptr[h]
+             for h in range(self._num_nodes)))
+        queue = [h for h in range(self._num_nodes) if in_degree[h] == 0]
+        result = []
+        while queue:
+            h = queue.pop()
+            result.append(h)
+            for h_child in self.get_children(h):
+                in_degree[h_child] -= 1
+                if in_degree[h_child] == 0:
+                    queue.append(h_child)
+        if len(result) != self._num_nodes:
+            raise ValueError('Detected a cyclic link in DAG.')
+        return result
+
+    def add_node(self, n):
+        raise TypeError('CompactDAG is read-only.')
+
+    def add_nodes(self, nodes, check_cycle=False):
+        raise TypeError('CompactDAG is read-only.')
+
+    def rm_node(self, h, recursive=False):
+        raise TypeError('CompactDAG is read-only.')
+
+    def rm_nodes(self, hs):
+        raise TypeError('CompactDAG is read-only.')
+
+    def __init_columns(self, nodes):
+        """Store nodes column-wise if they are namedtuples of the same type.
+        Equal values are interned so that they are stored only once.
+        """
+        node_type = type(nodes[0]) if nodes else None
+        if node_type is None or not hasattr(node_type, '_fields') or \
+                any(type(n) is not node_type for n in nodes):
+            self._node_type = None
+            self._columns = None
+            self._node_list = nodes
+            return
+
+        self._node_type = node_type
+        self._node_list = None
+        self._columns = []
+        for i in range(len(node_type._fields)):
+            interned = {}
+            col = []
+            for n in nodes:
+                val = n[i]
+                try:
+                    # keep type in key not to mix up 1, 1.0 and True
+                    val = interned.setdefault((type(val), val), val)
+                except TypeError:
+                    # unhashable value cannot be interned
+                    pass
+                col.append(val)
+            self._columns.append(col)
+
+    def __init_csr(self, children):
+        """Make CSR arrays for children and then transpose it for parents.
+        """
+        self._child_ptr = array(CompactDAG.TYPECODE_PTR, [0])
+        self._child_ids = array(CompactDAG.TYPECODE_ID)
+        in_degree = [0] * self._num_nodes
+        for h_children in children:
+            h_children = sorted(h_children)
+            self._child_ids.extend(h_children)
+            self._child_ptr.append(len(self._child_ids))
+            for h_child in h_children:
+                in_degree[h_child] += 1
+
+        self._parent_ptr = array(CompactDAG.TYPECODE_PTR, [0])
+        for d in in_degree:
+            self._parent_ptr.append(self._parent_ptr[-1] + d)
+        self._parent_ids = array(
+            CompactDAG.TYPECODE_ID, bytes(
+                array(CompactDAG.TYPECODE_ID).itemsize * len(self._child_ids)))
+        pos = self._parent_ptr[:-1]
+        for h in range(self._num_nodes):
+            for h_child in self.get_children(h):
+                self._parent_ids[pos[h_child]] = h
+                pos[h_child] += 1
+
+    def __init_attr_index(self, indexed_attrs):
+        self._indexed_attrs = tuple(indexed_attrs) if indexed_attrs else ()
+        self._attr_index = {}
+        for attr in self._indexed_attrs:
+            if self._node_list is None:
+                vals = self._columns[self._node_type._fields.index(attr)]
+            else:
+                vals = [getattr(n, attr) for n in self._node_list]
+            index = {}
+            for h, val in enumerate(vals):
+                index.setdefault(val, []).append(h)
+            self._attr_index[attr] = index
@@ -6,18 +6,69 @@ Author:
     Jin Lee (leepc12@gmail.com) at ENCODE-DCC
 """
 
-import re
+import itertools
 import json
-from autouri import AutoURI
-from collections import OrderedDict, namedtuple
-from WDL import parse_document
+import os
+import re
+import sys
+from array import array
+from collections import namedtuple
+from functools import lru_cache
+from . import json_backend
 from .dag import DAG
+from .compact_dag import CompactDAG
 
 
 CMNode = namedtuple('CMNode',
     ('type', 'shard_idx', 'task_name', 'output_name', 'output_path',
      'all_outputs', 'all_inputs'))
 
+# Schema of metadata JSON for keys used by CromwellMetadata.
+# Only these keys are kept while loading metadata JSON.
+# A dict maps a key to a schema for its value
+# ('*' means any key and None means keeping the whole value).
+# A schema for an array is applied to each element.
+METADATA_SCHEMA_CALLS = {}
+METADATA_SCHEMA_CALL = {
+    'shardIndex': None,
+    'executionStatus': None,
+    'inputs': None,
+    'outputs': None,
+    'subWorkflowMetadata': {
+        'id': None,
+        'calls': METADATA_SCHEMA_CALLS,
+    },
+}
+METADATA_SCHEMA_CALLS['*'] = METADATA_SCHEMA_CALL
+METADATA_SCHEMA = {
+    'id': None,
+    'submittedFiles': {
+        'inputs': None,
+        'workflow': None,
+    },
+    'calls': METADATA_SCHEMA_CALLS,
+}
+
+
+def cmnode_from_json(n):
+    """Make CMNode from a JSON array (tuples were written as arrays).
+    """
+    def files_from_json(files):
+        if files is None:
+            return None
+        return tuple((k, path, tuple(idx)) for k, path, idx in files)
+
+    type_, shard_idx, task_name, output_name, output_path, \
+        all_outputs, all_inputs = n
+    return CMNode(
+        type=type_,
+        shard_idx=None if shard_idx is None else tuple(shard_idx),
+        task_name=task_name,
+        output_name=output_name,
+        output_path=output_path,
+        all_outputs=files_from_json(all_outputs),
+        all_inputs=files_from_json(all_inputs))
+
 
 def is_parent_cmnode(n1, n2):
     """Check if n1 is a parent node of n2.
@@ -38,32 +89,210 @@ def is_parent_cmnode(n1, n2):
     return False
 
 
-def find_files_in_dict(d):
-    files = []
+def get_keys_as_parent_cmnode(n):
+    """Keys that children of n look up to find n.
+    Indexing nodes with these keys is equivalent to is_parent_cmnode():
+    1) task: (task_name, shard_idx) to be found by its own outputs
+    2) output: output_path to be found by tasks taking it as an input
+    """
+    if n.type == 'task':
+        return (('task', n.task_name, n.shard_idx),)
+    elif n.type == 'output':
+        return (('path', n.output_path),)
+    raise ValueError('Unsupported CMNode type: {}.'.format(n.type))
+
+
+def get_keys_as_child_cmnode(n):
+    """Keys that n looks up to find its parents.
+    """
+    if n.type == 'task':
+        if n.all_inputs is None:
+            return ()
+        return tuple(('path', path) for _, path, _ in n.all_inputs)
+    elif n.type == 'output':
+        if n.task_name is None:
+            return ()
+        return (('task', n.task_name, n.shard_idx),)
+    raise ValueError('Unsupported CMNode type: {}.'.format(n.type))
+
+
+def build_from_json_events(events, schema):
+    """Build a Python object from JSON parser events while keeping
+    keys defined in a schema only. Values of other keys are skipped
+    without being constructed.
+
+    Args:
+        events:
+            iterable of (prefix, event, value) from ijson.parse().
+        schema:
+            See METADATA_SCHEMA for details. None to keep everything.
+    """
+    result = None
+    # [container, schema for container, current key if container is dict]
+    stack = []
+    skip_next = False
+    skip_depth = 0
+
+    for _, event, value in events:
+        if skip_depth:
+            if event in ('start_map', 'start_array'):
+                skip_depth += 1
+            elif event in ('end_map', 'end_array'):
+                skip_depth -= 1
+            continue
+
+        if event == 'map_key':
+            sch = stack[-1][1]
+            if sch is None or value in sch or '*' in sch:
+                stack[-1][2] = value
+            else:
+                skip_next = True
+            continue
+
+        if event in ('end_map', 'end_array'):
+            obj = stack.pop()[0]
+            if not stack:
+                result = obj
+            continue
+
+        if skip_next:
+            skip_next = False
+            if event in ('start_map', 'start_array'):
+                skip_depth = 1
+            continue
+
+        # schema for a new value
+        if not stack:
+            sch = schema
+        else:
+            parent, parent_sch, key = stack[-1]
+            if parent_sch is None or isinstance(parent, list):
+                sch = parent_sch
+            else:
+                sch = parent_sch.get(key, parent_sch.get('*'))
+
+        if event == 'start_map':
+            obj = {}
+        elif event == 'start_array':
+            obj = []
+        else:
+            obj = value
+
+        if stack:
+            parent, _, key = stack[-1]
+            if isinstance(parent, list):
+                parent.append(obj)
+            else:
+                parent[key] = obj
+        elif event not in ('start_map', 'start_array'):
+            result = obj
+
+        if event in ('start_map', 'start_array'):
+            stack.append([obj, sch, None])
+
+    return result
+
+
+def filter_by_schema(obj, schema):
+    """Keep keys defined in a schema only.
+    See METADATA_SCHEMA for details of schema.
+    """
+    if schema is None:
+        return obj
+    if isinstance(obj, list):
+        return [filter_by_schema(v, schema) for v in obj]
+    if isinstance(obj, dict):
+        result = {}
+        for k, v in obj.items():
+            if k in schema:
+                result[k] = filter_by_schema(v, schema[k])
+            elif '*' in schema:
+                result[k] = filter_by_schema(v, schema['*'])
+        return result
+    return obj
+
+
+def load_metadata_json_stream(fp):
+    """Incrementally parse metadata JSON from a binary file object.
+    Only keys in METADATA_SCHEMA are kept so that peak memory usage
+    scales with data used by CromwellMetadata, not with the file size.
+    Requires ijson.
+
+    Returns:
+        dict (or list of dicts) of filtered metadata JSON.
+    """
+    try:
+        import ijson
+    except ImportError:
+        raise ImportError(
+            'Streaming metadata JSON requires ijson. '
+            'Install it with "pip install ijson".')
+    try:
+        events = ijson.parse(fp, use_float=True)
+    except TypeError:
+        # use_float is not supported by old ijson
+        events = ijson.parse(fp)
+    return build_from_json_events(events, METADATA_SCHEMA)
+
+
+# local absolute path or URI supported by autouri (gs://, s3://, http(s)://)
+RE_PATTERN_VALID_URI = re.compile(r'/|(?:gs|s3|https?)://')
+
+
+@lru_cache(maxsize=1024 * 64)
+def is_valid_uri(s):
+    """Check if a string is a file (local path or URI).
+    Same as AutoURI(s).is_valid but much faster since no AutoURI object
+    is constructed. Results are memoized since the same path can appear
+    many times (e.g. an output of a task is an input of other tasks).
+    """
+    if RE_PATTERN_VALID_URI.match(s):
+        return True
+    if s.startswith('~'):
+        # AbsPath expands user's home
+        return os.path.isabs(os.path.expanduser(s))
+    return False
+
+
+def iter_children(v, shard_idx):
+    """Iterate over elements of an array (Array) or
+    values of an object (Map, Pair, Struct) in WDL value.
+    Index of an array element is appended to shard_idx.
+    """
+    if isinstance(v, list):
+        return ((v_, shard_idx + (i,)) for i, v_ in enumerate(v))
+    return ((v_, shard_idx) for v_ in v.values())
+
+
+def iter_files_in_dict(d):
+    """Find files in a dict (e.g. inputs/outputs of a call) lazily.
+    Values are traversed iteratively (without recursion) so that
+    any shape of WDL value with any depth is supported
+    (e.g. Array[Array[Array[File]]], Map[String, File], Pair, Struct).
+
+    Yields:
+        (key, path, shard_idx) where shard_idx is a tuple of indices in
+        nested arrays. (-1,) if a file is not in an array.
+        e.g. ('bams', '/some/where/rep2.bam', (1,)) for d['bams'][1]
+    """
     for k, v in d.items():
-        maybe_files = []
-        if isinstance(v, list):
-            for i, v_ in enumerate(v):
-                if isinstance(v_, str):
-                    maybe_files.append((v_, (i,)))
-                elif isinstance(v_, list):
-                    for j, v__ in enumerate(v_):
-                        if isinstance(v__, str):
-                            maybe_files.append((v__, (i, j)))
-                        elif isinstance(v__, list):
-                            for k, v___ in enumerate(v__):
-                                if isinstance(v___, str):
-                                    maybe_files.append((v___, (i, j, k)))
-        elif isinstance(v, dict):
-            for _, v_ in v.items():
+        stack = [iter(((v, ()),))]
+        while stack:
+            for v_, shard_idx in stack[-1]:
                 if isinstance(v_, str):
-                    maybe_files.append((v_, (-1,)))
-        elif isinstance(v, str):
-            maybe_files.append((v, (-1,)))
-        for f, shard_idx in maybe_files:
-            if AutoURI(f).is_valid:
-                files.append((k, f, shard_idx))
-    return files
+                    if is_valid_uri(v_):
+                        yield k, v_, shard_idx if shard_idx else (-1,)
+                elif isinstance(v_, (list, dict)):
+                    stack.append(iter_children(v_, shard_idx))
+                    break
+            else:
+                stack.pop()
+
+
+def find_files_in_dict(d):
+    """List version of iter_files_in_dict().
+    """
+    return list(iter_files_in_dict(d))
 
 
 class CromwellMetadata(object):
@@ -72,41 +301,139 @@ class CromwellMetadata(object):
     RE_PATTERN_WDL_COMMENT_OUT_DEF_JSON = \
         r'^\s*\#\s*CROO\s+out_def\s(.+)'
     WDL_WORKFLOW_META_OUT_DEF = 'croo_out_def'
-
-    def __init__(self, metadata_json, debug=False):
-        self._metadata_json = metadata_json
-
+    DAG_INDEXED_ATTRS = ('type', 'task_name', 'output_name')
+    DAG_PARAMS = {
+        'fnc_is_parent': is_parent_cmnode,
+        'fnc_keys_as_parent': get_keys_as_parent_cmnode,
+        'fnc_keys_as_child': get_keys_as_child_cmnode,
+        'indexed_attrs': DAG_INDEXED_ATTRS,
+    }
+
+    def __init__(self, metadata_json, debug=False, compact_dag=False):
+        """
+        Args:
+            metadata_json:
+                dict of Cromwell's metadata JSON.
+            compact_dag:
+                Use a read-only CompactDAG instead of DAG for a task graph.
+                This saves a lot of memory for a huge metadata JSON.
+        """
+        # metadata JSON itself is not kept in this object
+        # so that it can be released after parsing
         # input JSON
-        if 'submittedFiles' in self._metadata_json:
-            self._input_json = json.loads(
-                self._metadata_json['submittedFiles']['inputs'],
-                object_pairs_hook=OrderedDict)
+        if 'submittedFiles' in metadata_json:
+            # key order is kept in all JSON backends
+            self._input_json = json_backend.loads(
+                metadata_json['submittedFiles']['inputs'])
             # WDL contents
-            self._wdl_str = self._metadata_json['submittedFiles']['workflow']
-            self._out_def_json_file = self.__find_out_def_from_wdl()
+            self._wdl_str = metadata_json['submittedFiles']['workflow']
         else:
             # Would work also with sub-workflow metadata that does not
             # contain 'submittedFiles'
             self._input_json = None
             # WDL contents
             self._wdl_str = None
-            self._out_def_json_file = None
+        # WDL will be parsed only when out_def JSON file is requested
+        self._out_def_json_file = None
+        self._out_def_json_file_searched = False
         # workflow ID
-        self._workflow_id = self._metadata_json['id']
-
-        # construct an indexed DAG
-        self._dag = DAG(fnc_is_parent=is_parent_cmnode)
-
-        # parse calls to add tasks and their outputs to graph
-        self.__parse_calls(self._metadata_json['calls'])
-
-        # parse input JSON to add inputs to graph
-        self.__parse_input_json()
+        self._workflow_id = metadata_json['id']
+
+        # parse calls to get tasks and their outputs
+        # and then parse input JSON to get inputs
+        nodes = itertools.chain(
+            self.__parse_calls(metadata_json['calls']),
+            self.__parse_input_json())
+
+        # construct an indexed DAG with all nodes at once
+        # links are made by looking up output paths and (task, shard) keys
+        dag_cls = CompactDAG if compact_dag else DAG
+        self._dag = dag_cls.from_nodes(
+            nodes, check_cycle=True, **CromwellMetadata.DAG_PARAMS)
+        # release parsed input JSON
+        self._input_json = None
 
         self._debug = debug
         if self._debug:
             print(self._dag)
 
+    @classmethod
+    def load_from_cache(cls, cache_file, croo_version,
+                        debug=False, compact_dag=False):
+        """Load parsed metadata from a cache file written by save_to_cache().
+        Metadata JSON and WDL are not parsed at all.
+        WDL is not parsed either if out_def JSON file was already searched.
+
+        Raises:
+            ValueError if cache file was written by a different version of croo
+            or on a machine with a different byte order.
+        """
+        with open(cache_file, 'rb') as fp:
+            cache = json_backend.loads(fp.readline())
+            if cache.get('croo_version') != croo_version:
+                raise ValueError(
+                    'Cache file was written by a different version of croo. '
+                    'cache: {c}, current: {v}'.format(
+                        c=cache.get('croo_version'), v=croo_version))
+            e = array('I')
+            if cache['byteorder'] != sys.byteorder or \
+                    cache['itemsize'] != e.itemsize:
+                raise ValueError(
+                    'Cache file was written on a different platform.')
+            e.frombytes(fp.read())
+        if len(e) != cache['num_edges'] * 2:
+            raise ValueError('Cache file is truncated.')
+
+        cm = cls.__new__(cls)
+        cm._input_json = None
+        cm._wdl_str = cache['wdl_str']
+        cm._out_def_json_file = cache['out_def_json_file']
+        cm._out_def_json_file_searched = cache['out_def_json_file_searched']
+        cm._workflow_id = cache['workflow_id']
+
+        nodes = [cmnode_from_json(n) for n in cache['nodes']]
+        edges = zip(itertools.islice(e, 0, None, 2),
+                    itertools.islice(e, 1, None, 2))
+        dag_cls = CompactDAG if compact_dag else DAG
+        cm._dag = dag_cls.from_edges(
+            nodes, edges, **CromwellMetadata.DAG_PARAMS)
+
+        cm._debug = debug
+        if cm._debug:
+            print(cm._dag)
+        return cm
+
+    def save_to_cache(self, cache_file, croo_version):
+        """Save parsed metadata (workflow ID, WDL contents and out_def JSON
+        file if already searched, nodes and links of a task graph)
+        to a cache file. Data only (no pickle) since tmp_dir can be shared.
+        First line is a JSON object with everything but links.
+        Links follow it as a flat binary array of positional indices of nodes.
+        """
+        nodes, edges = self._dag.to_edges()
+        e = array('I', itertools.chain.from_iterable(edges))
+        cache = {
+            'croo_version': croo_version,
+            'workflow_id': self._workflow_id,
+            'wdl_str': self._wdl_str,
+            'out_def_json_file': self._out_def_json_file,
+            'out_def_json_file_searched': self._out_def_json_file_searched,
+            'nodes': [tuple(n) for n in nodes],
+            'byteorder': sys.byteorder,
+            'itemsize': e.itemsize,
+            'num_edges': len(e) // 2,
+        }
+        # write to a temporary file first to make it atomic
+        tmp_cache_file = '{f}.{pid}.tmp'.format(f=cache_file, pid=os.getpid())
+        with open(tmp_cache_file, 'wb') as fp:
+            # newlines in strings are escaped so that it's a single line
+            fp.write(json.dumps(cache).encode() + b'\n')
+            e.tofile(fp)
+        os.replace(tmp_cache_file, cache_file)
+
+    def is_out_def_json_file_searched(self):
+        return self._out_def_json_file_searched
+
     def get_workflow_id(self):
         return self._workflow_id
 
@@ -114,15 +441,24 @@ class CromwellMetadata(object):
         return self._dag
 
     def get_out_def_json_file(self):
+        """Find out_def JSON file defined in WDL.
+        WDL is searched (and parsed if required) only on the first call.
+        """
+        if not self._out_def_json_file_searched:
+            self._out_def_json_file = self.__find_out_def_from_wdl()
+            self._out_def_json_file_searched = True
         return self._out_def_json_file
 
     def __parse_input_json(self):
-        """Recursively parse input JSON to add input files to graph
+        """Recursively parse input JSON to find input files
+
+        Yields:
+            CMNode for each input file
         """
         if self._input_json is None:
             return
 
-        for file_name, file_path, shard_idx in find_files_in_dict(self._input_json):
+        for file_name, file_path, shard_idx in iter_files_in_dict(self._input_json):
             # add it as an "output" without an associated task
             n = CMNode(
                 type='output',
@@ -132,11 +468,14 @@ class CromwellMetadata(object):
                 output_path=file_path,
                 all_outputs=None,
                 all_inputs=None)
-            self._dag.add_node(n)
+            yield n
 
     def __parse_calls(self, calls, parent_wf_name='',
                       wf_alias=None, parent_wf_shard_idx=()):
         """Recursively parse calls in metadata JSON for subworkflow
+
+        Yields:
+            CMNode for each task and its output files
         """
         for call_name, call_list in calls.items():
             for _, c in enumerate(call_list):
@@ -150,7 +489,7 @@ class CromwellMetadata(object):
 
                 # if it is a subworkflow, then recursively dive into it
                 if 'subWorkflowMetadata' in c:
-                    self.__parse_calls(
+                    yield from self.__parse_calls(
                         c['subWorkflowMetadata']['calls'],
                         parent_wf_name=parent_wf_name + wf_name + '.',
                         wf_alias=task_alias,
@@ -179,7 +518,7 @@ class CromwellMetadata(object):
                     output_path=None,
                     all_outputs=tuple(out_files) if out_files else None,
                     all_inputs=tuple(in_files) if in_files else None)
-                self._dag.add_node(n)
+                yield n
 
                 if out_files:
                     for output_name, output_path, _ in out_files:
@@ -192,17 +531,23 @@ class CromwellMetadata(object):
                             output_path=output_path,
                             all_outputs=None,
                             all_inputs=None)
-                        self._dag.add_node(n)
+                        yield n
 
     def __find_out_def_from_wdl(self):
-        r = self.__find_workflow_meta(
-            CromwellMetadata.WDL_WORKFLOW_META_OUT_DEF)
-        if r is not None:
-            return r
+        """Find out_def JSON file in a comment (#CROO out_def) first.
+        WDL is parsed to look into workflow's meta section only if
+        such comment is not found.
+        """
+        if self._wdl_str is None:
+            return None
 
         r = self.__find_val_from_wdl(
             CromwellMetadata.RE_PATTERN_WDL_COMMENT_OUT_DEF_JSON)
-        return r[0] if len(r) > 0 else None
+        if len(r) > 0:
+            return r[0]
+
+        return self.__find_workflow_meta(
+            CromwellMetadata.WDL_WORKFLOW_META_OUT_DEF)
 
     def __find_val_from_wdl(self, regex_val):
         result = []
@@ -221,6 +566,8 @@ class CromwellMetadata(object):
             None if key not found or any error occurs.
         """
         try:
+            # miniwdl is slow to import so import it only when required
+            from WDL import parse_document
             wdl = parse_document(self._wdl_str)
             if key in wdl.workflow.meta:
                 return wdl.workflow.meta[key]
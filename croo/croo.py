@@ -1,10 +1,24 @@
+import hashlib
 import os
 import logging
-import json
 import re
+from concurrent.futures import ThreadPoolExecutor
 from autouri import AutoURI, AbsPath, GCSURI, S3URI
+from . import __version__
+from . import json_backend
 from .croo_html_report import CrooHtmlReport
-from .cromwell_metadata import CromwellMetadata
+from .cromwell_metadata import (
+    CromwellMetadata, METADATA_SCHEMA, filter_by_schema,
+    load_metadata_json_stream)
+from .transfer import (
+    ChecksumManifest, Transfer, TransferEngine, TransferJournal,
+    TransferManifest, get_content_key, is_referenced_only,
+    TRANSFER_METHOD_COPY, TRANSFER_METHOD_HARDLINK,
+    TRANSFER_METHOD_LINK, TRANSFER_METHODS)
+from .object_index import ObjectIndex, get_metadata, list_uris
+from .transfer_plan import (
+    PlanEntry, PLAN_ENTRY_TYPE_INPUT, PLAN_ENTRY_TYPE_OUTPUT,
+    plan_to_json_str, plan_to_tsv_str)
 
 
 logger = logging.getLogger(__name__)
@@ -19,6 +33,16 @@ class Croo(object):
     RE_PATTERN_INLINE_EXP = r'\$\{(.*?)\}'
     KEY_TASK_GRAPH_TEMPLATE = 'task_graph_template'
     KEY_INPUT = 'inputs'
+    METADATA_CACHE = 'croo.metadata_cache.{metadata_md5}.{version}.bin'
+    PLAN_JSON = 'croo.plan.{workflow_id}.json'
+    PLAN_TSV = 'croo.plan.{workflow_id}.tsv'
+    JOURNAL = 'croo.journal.{workflow_id}.jsonl'
+    MANIFEST = 'croo.manifest.{workflow_id}.json'
+    CHECKSUMS = 'croo.checksums.{workflow_id}.tsv'
+    # for a shard (subset) of a plan
+    JOURNAL_SHARD = 'croo.journal.{workflow_id}.shard-{shard}.jsonl'
+    MANIFEST_SHARD = 'croo.manifest.{workflow_id}.shard-{shard}.json'
+    CHECKSUMS_SHARD = 'croo.checksums.{workflow_id}.shard-{shard}.tsv'
 
     def __init__(self, metadata_json, out_def_json, out_dir,
                  tmp_dir,
@@ -32,7 +56,16 @@ class Croo(object):
                  public_gcs=False,
                  gcp_private_key=None,
                  map_path_to_url=None,
-                 no_checksum=False):
+                 no_checksum=False,
+                 compact_task_graph=False,
+                 use_metadata_cache=False,
+                 stream_metadata=False,
+                 num_workers=1,
+                 use_journal=False,
+                 use_manifest=False,
+                 method=None,
+                 dedup=False,
+                 use_checksums=False):
         """Initialize croo with output definition JSON
         Args:
             soft_link:
@@ -40,25 +73,51 @@ class Croo(object):
                 (source) on out_dir (destination).
                 Try to soft-link it if both src and dest are on local storage.
                 Otherwise, original cromwell outputs will be just referenced.
+            compact_task_graph:
+                Use a compact read-only task graph to save memory.
+            use_metadata_cache:
+                Cache parsed metadata (task graph, workflow ID, ...) on tmp_dir
+                and re-use it for the same metadata JSON file.
+                Cache file is keyed by md5 hash of metadata JSON file and
+                croo's version.
+            stream_metadata:
+                Parse metadata JSON file incrementally and keep only keys
+                used by croo. Peak memory usage does not scale with
+                the size of metadata JSON file. Requires ijson.
+            num_workers:
+                Number of threads to link/copy files in parallel.
+                A failed file does not stop others. All failures are logged
+                and then an exception is raised without writing a report.
+            use_journal:
+                Write completed transfers to a journal file on tmp_dir.
+                A restarted run skips transfers found in the journal
+                without checking files on out_dir again.
+                Journal is removed after all transfers are done.
+            use_manifest:
+                Write all transfers with size/mtime of their sources
+                to a manifest file on out_dir at the end.
+                A next run skips transfers with an unchanged source
+                (same size/mtime) without checking md5 of files.
+            method:
+                link, copy, hardlink or reflink. See transfer_file() for
+                details. If not defined, link if soft_link else copy.
+            dedup:
+                For copy method, copy files with the same contents only once
+                and make other copies from there (hard link for local storage).
+            use_checksums:
+                Write checksums (size, md5, crc32c) of all organized files
+                (except soft links) to a single TSV file on out_dir
+                instead of letting autouri write an .md5 file next to
+                a copied file. A next run skips copying a file from
+                a cloud bucket if md5 in its metadata matches the one in it.
         """
         self._tmp_dir = tmp_dir
-        if isinstance(metadata_json, dict):
-            self._metadata = metadata_json
-        else:
-            f = AutoURI(metadata_json).localize_on(self._tmp_dir)
-            with open(f, 'r') as fp:
-                self._metadata = json.loads(fp.read())
-            if isinstance(self._metadata, list):
-                if len(self._metadata) > 1:
-                    logger.warning(
-                        'Multiple metadata JSON objects '
-                        'found in metadata JSON file. Taking the first '
-                        'one...')
-                elif len(self._metadata) == 0:
-                    raise Exception('metadata JSON file is empty')
-                self._metadata = self._metadata[0]
         self._out_dir = out_dir
-        self._cm = CromwellMetadata(self._metadata)
+        self._compact_task_graph = compact_task_graph
+        self._use_metadata_cache = use_metadata_cache
+        self._stream_metadata = stream_metadata
+        self._metadata_cache_file = None
+        self._cm = self.__load_metadata(metadata_json)
         self._ucsc_genome_db = ucsc_genome_db
         self._ucsc_genome_pos = ucsc_genome_pos
 
@@ -70,6 +129,10 @@ class Croo(object):
         self._gcp_private_key = gcp_private_key
         self._map_path_to_url = map_path_to_url
         self._no_checksum = no_checksum
+        self._num_workers = num_workers
+        self._use_journal = use_journal
+        self._use_manifest = use_manifest
+        self._use_checksums = use_checksums
 
         if isinstance(out_def_json, dict):
             self._out_def_json = out_def_json
@@ -83,8 +146,9 @@ class Croo(object):
                                      'to your WDL')
                 out_def_json = out_def_json_file_from_wdl
             f = AutoURI(out_def_json).localize_on(self._tmp_dir)
-            with open(f, 'r') as fp:
-                self._out_def_json = json.loads(fp.read())
+            self._out_def_json = json_backend.load_file(f)
+        # write cache after out_def JSON file is searched in WDL (if required)
+        self.__save_metadata_cache()
 
         self._task_graph = self._cm.get_task_graph()
         if Croo.KEY_TASK_GRAPH_TEMPLATE in self._out_def_json:
@@ -95,53 +159,166 @@ class Croo(object):
             self._input_def_json = self._out_def_json.pop(Croo.KEY_INPUT)
         else:
             self._input_def_json = None
-        self._soft_link = soft_link
+        if method is None:
+            method = TRANSFER_METHOD_LINK if soft_link else TRANSFER_METHOD_COPY
+        elif method not in TRANSFER_METHODS:
+            raise ValueError('Unsupported method: {}.'.format(method))
+        self._method = method
+        self._dedup = dedup
+        self._object_index = ObjectIndex(num_threads=num_workers)
+
+    def __load_metadata(self, metadata_json):
+        """Parse metadata JSON (or load it from cache) to make
+        CromwellMetadata.
+        Metadata JSON is not kept in memory after CromwellMetadata is made.
+        """
+        if isinstance(metadata_json, dict):
+            return CromwellMetadata(
+                metadata_json, compact_dag=self._compact_task_graph)
+
+        f = AutoURI(metadata_json).localize_on(self._tmp_dir)
 
-    def organize_output(self):
+        cache_file = None
+        if self._use_metadata_cache and self._tmp_dir is not None:
+            cache_file = os.path.join(
+                self._tmp_dir,
+                Croo.METADATA_CACHE.format(
+                    metadata_md5=Croo.__md5sum(f), version=__version__))
+            if os.path.exists(cache_file):
+                try:
+                    cm = CromwellMetadata.load_from_cache(
+                        cache_file,
+                        croo_version=__version__,
+                        compact_dag=self._compact_task_graph)
+                    logger.info(
+                        'Loaded parsed metadata from cache. {f}'.format(
+                            f=cache_file))
+                    if not cm.is_out_def_json_file_searched():
+                        # write it again once out_def JSON file is searched
+                        self._metadata_cache_file = cache_file
+                    return cm
+                except Exception:
+                    logger.warning(
+                        'Failed to load parsed metadata from cache. '
+                        'Parsing metadata JSON file again. {f}'.format(
+                            f=cache_file),
+                        exc_info=True)
+
+        if self._stream_metadata:
+            with json_backend.open_file(f) as fp:
+                metadata = load_metadata_json_stream(fp)
+        else:
+            # drop keys not used by croo (e.g. executionEvents, callCaching)
+            # right after loading to release most of metadata JSON
+            metadata = filter_by_schema(
+                json_backend.load_file(f), METADATA_SCHEMA)
+        if isinstance(metadata, list):
+            if len(metadata) > 1:
+                logger.warning(
+                    'Multiple metadata JSON objects '
+                    'found in metadata JSON file. Taking the first '
+                    'one...')
+            elif len(metadata) == 0:
+                raise Exception('metadata JSON file is empty')
+            metadata = metadata[0]
+        cm = CromwellMetadata(metadata, compact_dag=self._compact_task_graph)
+        del metadata
+
+        self._metadata_cache_file = cache_file
+        return cm
+
+    def __save_metadata_cache(self):
+        """Write parsed metadata to cache if it's not loaded from cache
+        or out_def JSON file has been searched since it was loaded.
+        """
+        cache_file = self._metadata_cache_file
+        if cache_file is None:
+            return
+        if os.path.exists(cache_file) and \
+                not self._cm.is_out_def_json_file_searched():
+            return
+        try:
+            os.makedirs(self._tmp_dir, exist_ok=True)
+            self._cm.save_to_cache(cache_file, croo_version=__version__)
+        except Exception:
+            logger.warning(
+                'Failed to write parsed metadata to cache. {f}'.format(
+                    f=cache_file),
+                exc_info=True)
+        self._metadata_cache_file = None
+
+    @staticmethod
+    def __md5sum(f, chunk_size=1024 * 1024):
+        md5 = hashlib.md5()
+        with open(f, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(chunk_size), b''):
+                md5.update(chunk)
+        return md5.hexdigest()
+
+    def organize_output(self, dry_run=False, plan=None):
         """Organize outputs
+
+        Args:
+            dry_run:
+                Make a plan and write it to JSON/TSV files on out_dir
+                without transferring any files or making a report.
+            plan:
+                Execute this plan (list of PlanEntry) instead of making a new
+                one. e.g. a subset of a plan loaded with load_plan_json().
+                See execute_plan() for a subset of a plan.
         """
-        report = CrooHtmlReport(
-            out_dir=self._out_dir,
-            workflow_id=self._cm.get_workflow_id(),
-            dag=self._task_graph,
-            task_graph_template=self._task_graph_template,
-            public_gcs=self._public_gcs,
-            gcp_private_key=self._gcp_private_key,
-            use_presigned_url_gcs=self._use_presigned_url_gcs,
-            use_presigned_url_s3=self._use_presigned_url_s3,
-            duration_presigned_url_s3 = self._duration_presigned_url_s3,
-            duration_presigned_url_gcs = self._duration_presigned_url_gcs,
-            map_path_to_url=self._map_path_to_url,
-            ucsc_genome_db=self._ucsc_genome_db,
-            ucsc_genome_pos=self._ucsc_genome_pos)
+        shard = None
+        if plan is None:
+            plan = self.make_plan(get_size=dry_run)
+        elif not dry_run:
+            shard = self.__get_shard(plan)
+        if dry_run:
+            self.save_plan(plan)
+        else:
+            self.execute_plan(plan, shard=shard)
+
+    def make_plan(self, get_size=False):
+        """Resolve all entries in output definition JSON against task graph.
+        Nothing is transferred here.
 
+        Args:
+            get_size:
+                Get size of each file to be transferred.
+                This can be slow for a huge number of files on cloud buckets.
+        Returns:
+            list of PlanEntry in the order of rows in a report.
+        """
+        plan = []
         if self._input_def_json is not None:
             for input_name, input_obj in self._input_def_json.items():
                 node_format = input_obj.get('node')
                 subgraph = input_obj.get('subgraph')
+                if node_format is None:
+                    continue
 
-                for _, node in self._task_graph.get_nodes():
-                    # if node is pipeline's input
-                    if node.type != 'output' or node.task_name is not None \
-                            or node.output_name != input_name:
-                        continue
+                # pipeline's inputs are output nodes without a task
+                for _, node in self._task_graph.find_nodes_by_attrs(
+                        type='output', task_name=None,
+                        output_name=input_name):
                     full_path = node.output_path
                     shard_idx = node.shard_idx
 
-                    if node_format is not None:
-                        interpreted_node_format = Croo.__interpret_inline_exp(
-                            node_format, full_path, shard_idx)
-                        if subgraph is not None:
-                            interpreted_subgraph = Croo.__interpret_inline_exp(
-                                subgraph, full_path, shard_idx)
-                        else:
-                            interpreted_subgraph = None
-                        report.add_to_task_graph(node.output_name,
-                                                 None,
-                                                 shard_idx,
-                                                 full_path,
-                                                 interpreted_node_format,
-                                                 interpreted_subgraph)
+                    plan.append(PlanEntry(
+                        type=PLAN_ENTRY_TYPE_INPUT,
+                        task_name=None,
+                        output_name=node.output_name,
+                        shard_idx=shard_idx,
+                        source=full_path,
+                        target=None,
+                        method=None,
+                        size=None,
+                        table=None,
+                        ucsc_track=None,
+                        node=Croo.__interpret_inline_exp(
+                            node_format, full_path, shard_idx),
+                        subgraph=None if subgraph is None else
+                        Croo.__interpret_inline_exp(
+                            subgraph, full_path, shard_idx)))
 
         for task_name, out_vars in self._out_def_json.items():
             for output_name, output_obj in out_vars.items():
@@ -150,11 +327,13 @@ class Croo(object):
                 ucsc_track = output_obj.get('ucsc_track')
                 node_format = output_obj.get('node')
                 subgraph = output_obj.get('subgraph')
+                if path is None and table_item is None \
+                        and ucsc_track is None and node_format is None:
+                    continue
 
-                for _, node in self._task_graph.get_nodes():
-                    # look at output nodes only (not a task node)
-                    if task_name != node.task_name or node.type != 'task':
-                        continue
+                # look at task nodes only (not an output node)
+                for _, node in self._task_graph.find_nodes_by_attrs(
+                        type='task', task_name=task_name):
                     all_outputs = node.all_outputs
                     shard_idx = node.shard_idx
                     if not all_outputs:
@@ -164,81 +343,395 @@ class Croo(object):
                         if k != output_name:
                             continue
 
-                        target_uri = full_path
-                        if path is not None:
-                            interpreted_path = Croo.__interpret_inline_exp(
-                                path, full_path, shard_idx)
-
-                            au = AutoURI(full_path)
-                            target_path = os.path.join(self._out_dir, interpreted_path)
-
-                            if self._soft_link:
-                                au_target = AutoURI(target_path)
-                                if isinstance(au, AbsPath) and isinstance(au_target, AbsPath):
-                                    au.soft_link(target_path, force=True)
-                                    target_uri = target_path
-                                else:
-                                    target_uri = full_path
-                            else:
-                                target_uri = au.cp(
-                                    target_path,
-                                    no_checksum=self._no_checksum,
-                                    make_md5_file=True)
-
-                        # get presigned URLs if possible
-                        target_url = None
-                        if path is not None or table_item is not None \
-                                or ucsc_track is not None or node_format is not None:
-                            u = AutoURI(target_uri)
-
-                            if isinstance(u, GCSURI):
-                                if self._public_gcs:
-                                    target_url = u.get_public_url()
-
-                                elif self._use_presigned_url_gcs:
-                                    target_url = u.get_presigned_url(
-                                        duration=self._duration_presigned_url_gcs,
-                                        private_key_file=self._gcp_private_key)
-
-                            elif isinstance(u, S3URI):
-                                if self._use_presigned_url_s3:
-                                    target_url = u.get_presigned_url(
-                                        duration=self._duration_presigned_url_s3)
-
-                            elif isinstance(u, AbsPath):
-                                if self._map_path_to_url:
-                                    target_url = u.get_mapped_url(
-                                        map_path_to_url=self._map_path_to_url)
-
-                        if table_item is not None:
-                            interpreted_table_item = Croo.__interpret_inline_exp(
-                                table_item, full_path, shard_idx)
-                            # add to file table
-                            report.add_to_file_table(target_uri,
-                                                     target_url,
-                                                     interpreted_table_item)
-                        if ucsc_track is not None and target_url is not None:
-                            interpreted_ucsc_track = Croo.__interpret_inline_exp(
-                                ucsc_track, full_path, shard_idx)
-                            report.add_to_ucsc_track(target_url,
-                                                     interpreted_ucsc_track)
-                        if node_format is not None:
-                            interpreted_node_format = Croo.__interpret_inline_exp(
-                                node_format, full_path, shard_idx)
-                            if subgraph is not None:
-                                interpreted_subgraph = Croo.__interpret_inline_exp(
-                                    subgraph, full_path, shard_idx)
-                            else:
-                                interpreted_subgraph = None
-                            report.add_to_task_graph(output_name,
-                                                     task_name,
-                                                     shard_idx,
-                                                     full_path if target_url is None else target_url,
-                                                     interpreted_node_format,
-                                                     interpreted_subgraph)
+                        def interpret(s):
+                            if s is None:
+                                return None
+                            return Croo.__interpret_inline_exp(
+                                s, full_path, shard_idx)
+
+                        if path is None:
+                            target_path = None
+                        else:
+                            target_path = os.path.join(
+                                self._out_dir, interpret(path))
+
+                        plan.append(PlanEntry(
+                            type=PLAN_ENTRY_TYPE_OUTPUT,
+                            task_name=task_name,
+                            output_name=output_name,
+                            shard_idx=shard_idx,
+                            source=full_path,
+                            target=target_path,
+                            method=None if path is None else self._method,
+                            size=None,
+                            table=interpret(table_item),
+                            ucsc_track=interpret(ucsc_track),
+                            node=interpret(node_format),
+                            subgraph=interpret(subgraph)))
+
+        if self._dedup and self._method == TRANSFER_METHOD_COPY:
+            plan = self.__dedup_plan(plan)
+        if get_size:
+            plan = self.__get_sizes(plan)
+        return plan
+
+    def __dedup_plan(self, plan):
+        """Find copies with the same contents (same source URI, same inode or
+        same md5 in metadata of a cloud object) and copy such contents only once.
+        Other entries are transferred from the first entry's target (copy_from)
+        with a hard link on local storage or with a copy within
+        the target storage (e.g. server-side copy on a cloud bucket).
+        An entry is not deduplicated if its target is shared with others.
+        """
+        num_targets = {}
+        for e in plan:
+            if e.target is not None:
+                num_targets[e.target] = num_targets.get(e.target, 0) + 1
+        candidates = [
+            i for i, e in enumerate(plan)
+            if e.target is not None and e.method == TRANSFER_METHOD_COPY
+            and num_targets[e.target] == 1]
+
+        sources = list({plan[i].source: None for i in candidates})
+        self._object_index.add(sources, by_call_dir=True)
+        with ThreadPoolExecutor(max_workers=self._num_workers) as executor:
+            content_keys = dict(zip(sources, executor.map(
+                lambda source: get_content_key(source, self._object_index),
+                sources)))
+
+        first_targets = {}
+        num_dedup = 0
+        for i in candidates:
+            e = plan[i]
+            key = content_keys[e.source] or ('uri', e.source)
+            first_target = first_targets.setdefault(key, e.target)
+            if first_target == e.target:
+                continue
+            if isinstance(AutoURI(first_target), AbsPath) and \
+                    isinstance(AutoURI(e.target), AbsPath):
+                method = TRANSFER_METHOD_HARDLINK
+            else:
+                method = TRANSFER_METHOD_COPY
+            plan[i] = e._replace(copy_from=first_target, method=method)
+            num_dedup += 1
+
+        if num_dedup:
+            logger.info(
+                'Found {n} file(s) with the same contents as others. '
+                'They will be transferred from the first copy.'.format(
+                    n=num_dedup))
+        return plan
+
+    def __get_sizes(self, plan):
+        """Fill size of files to be transferred in a plan.
+        Size is None if it's not available.
+        """
+        self._object_index.add(
+            (e.source for e in plan
+             if e.target is not None and not is_referenced_only(e)),
+            by_call_dir=True)
+
+        def get_size(e):
+            # size is not required for a link on cloud buckets (no transfer)
+            if e.target is None or is_referenced_only(e):
+                return e
+            try:
+                m = get_metadata(e.source, self._object_index, skip_md5=True)
+                return e._replace(size=m.size)
+            except Exception:
+                logger.warning(
+                    'Failed to get size of a file. {f}'.format(f=e.source),
+                    exc_info=True)
+                return e
+
+        with ThreadPoolExecutor(max_workers=self._num_workers) as executor:
+            return list(executor.map(get_size, plan))
+
+    def save_plan(self, plan):
+        """Write a plan to JSON/TSV files on out_dir.
+        JSON file can be executed later with --plan-json.
+        """
+        workflow_id = self._cm.get_workflow_id()
+        uri_json = os.path.join(
+            self._out_dir, Croo.PLAN_JSON.format(workflow_id=workflow_id))
+        uri_tsv = os.path.join(
+            self._out_dir, Croo.PLAN_TSV.format(workflow_id=workflow_id))
+        AutoURI(uri_json).write(plan_to_json_str(plan))
+        AutoURI(uri_tsv).write(plan_to_tsv_str(plan))
+
+        transfers = [e for e in plan if e.target is not None]
+        sizes = [e.size for e in transfers if e.size is not None]
+        logger.info(
+            'Dry run: {n} file(s) to {m}, total {b} bytes '
+            '(size unknown for {u} file(s)). {f}'.format(
+                n=len(transfers),
+                m=self._method,
+                b=sum(sizes),
+                u=len(transfers) - len(sizes),
+                f=uri_json))
+
+    def execute_plan(self, plan, shard=None):
+        """Transfer files in a plan and then write a report.
+
+        Args:
+            shard:
+                ID of a shard if plan is a subset of a full plan.
+                Report is not written since it would miss files of
+                other shards. Journal/manifest/checksums are written to
+                separate files for this shard so that shards can run
+                at the same time. A run with a full plan merges them.
+        """
+        workflow_id = self._cm.get_workflow_id()
+
+        journal = None
+        if self._use_journal and self._tmp_dir is not None:
+            if shard is None:
+                journal_file = Croo.JOURNAL.format(workflow_id=workflow_id)
+            else:
+                journal_file = Croo.JOURNAL_SHARD.format(
+                    workflow_id=workflow_id, shard=shard)
+            journal = TransferJournal(os.path.join(self._tmp_dir, journal_file))
+        manifest = None
+        if self._use_manifest:
+            uri_manifest = os.path.join(
+                self._out_dir, Croo.MANIFEST.format(workflow_id=workflow_id))
+            manifest = TransferManifest.load(uri_manifest, self._tmp_dir)
+            uri_shard_manifests = self.__get_shard_uris(
+                Croo.MANIFEST_SHARD, workflow_id, shard)
+            for uri in uri_shard_manifests:
+                manifest.merge(TransferManifest.load(uri, self._tmp_dir))
+        checksums = None
+        if self._use_checksums:
+            uri_checksums = os.path.join(
+                self._out_dir, Croo.CHECKSUMS.format(workflow_id=workflow_id))
+            checksums = ChecksumManifest.load(uri_checksums, self._tmp_dir)
+            uri_shard_checksums = self.__get_shard_uris(
+                Croo.CHECKSUMS_SHARD, workflow_id, shard)
+            for uri in uri_shard_checksums:
+                checksums.merge(ChecksumManifest.load(uri, self._tmp_dir))
+
+        # list prefixes of sources/targets on cloud buckets once
+        # instead of probing each file before transferring it.
+        # nothing is listed for links on cloud buckets (no transfer)
+        transferred = [
+            e for e in plan if e.target is not None
+            and not is_referenced_only(e)]
+        if manifest is not None or not self._no_checksum:
+            # size/md5/identity of sources are required
+            self._object_index.add(
+                (e.source for e in transferred), by_call_dir=True)
+        if not self._no_checksum:
+            self._object_index.add(
+                uri for e in transferred for uri in (e.target, e.copy_from))
+
+        engine = TransferEngine(
+            num_workers=self._num_workers,
+            no_checksum=self._no_checksum,
+            journal=journal,
+            manifest=manifest,
+            index=self._object_index,
+            make_md5_file=checksums is None,
+            checksums=checksums,
+            # size/mtime of a local copy are enough with
+            # a manifest or checksums written by croo itself
+            quick_local_copy=manifest is not None or checksums is not None)
+        # entries with copy_from are transferred after all others are done
+        transfers = [e for e in plan if e.target is not None]
+        firsts = [
+            i for i, e in enumerate(transfers) if e.copy_from is None]
+        copies = [
+            i for i, e in enumerate(transfers) if e.copy_from is not None]
+        first_targets = set(transfers[i].target for i in firsts)
+        results = [None] * len(transfers)
+        try:
+            for i, r in zip(firsts, engine.run(
+                    [transfers[i] for i in firsts])):
+                results[i] = r
+            for i, r in zip(copies, engine.run(
+                    [self.__get_dedup_transfer(transfers[i], first_targets)
+                     for i in copies])):
+                results[i] = r
+        finally:
+            if journal is not None:
+                journal.close()
+        num_failed = sum(1 for r in results if r.error is not None)
+        if num_failed:
+            raise Exception(
+                'Failed to transfer {n} out of {t} file(s). '
+                'See error logs above.'.format(n=num_failed, t=len(results)))
+        if checksums is not None:
+            checksum_paths = [
+                r.target_uri for e, r in zip(transfers, results)
+                if e.method != TRANSFER_METHOD_LINK
+                and r.target_uri == e.target]
+            checksums.update(checksum_paths, num_threads=self._num_workers)
+
+        if shard is None:
+            self.__save_report(plan, results)
+            # files of shards are merged into a single file
+            if manifest is not None:
+                AutoURI(uri_manifest).write(manifest.to_json_str())
+                for uri in uri_shard_manifests:
+                    AutoURI(uri).rm()
+            if checksums is not None:
+                AutoURI(uri_checksums).write(checksums.to_tsv_str())
+                for uri in uri_shard_checksums:
+                    AutoURI(uri).rm()
+        else:
+            logger.info(
+                'Report is not written for a subset of a plan. '
+                'Run Croo with a full plan after all subsets are done '
+                'to write it.')
+            if manifest is not None:
+                AutoURI(uri_shard_manifests[0]).write(
+                    manifest.to_json_str(e.target for e in transfers))
+            if checksums is not None:
+                AutoURI(uri_shard_checksums[0]).write(
+                    checksums.to_tsv_str(checksum_paths))
+        if journal is not None:
+            journal.remove()
+
+    def __save_report(self, plan, results):
+        """Write a report for a full plan.
+
+        Args:
+            results:
+                TransferResult of each entry with a target in plan.
+        """
+        report = CrooHtmlReport(
+            out_dir=self._out_dir,
+            workflow_id=self._cm.get_workflow_id(),
+            dag=self._task_graph,
+            task_graph_template=self._task_graph_template,
+            public_gcs=self._public_gcs,
+            gcp_private_key=self._gcp_private_key,
+            use_presigned_url_gcs=self._use_presigned_url_gcs,
+            use_presigned_url_s3=self._use_presigned_url_s3,
+            duration_presigned_url_s3 = self._duration_presigned_url_s3,
+            duration_presigned_url_gcs = self._duration_presigned_url_gcs,
+            map_path_to_url=self._map_path_to_url,
+            ucsc_genome_db=self._ucsc_genome_db,
+            ucsc_genome_pos=self._ucsc_genome_pos)
+        results = iter(results)
+
+        for e in plan:
+            if e.type == PLAN_ENTRY_TYPE_INPUT:
+                report.add_to_task_graph(e.output_name,
+                                         None,
+                                         e.shard_idx,
+                                         e.source,
+                                         e.node,
+                                         e.subgraph)
+                continue
+
+            if e.target is None:
+                target_uri = e.source
+            else:
+                target_uri = next(results).target_uri
+
+            # get presigned URLs if possible
+            target_url = self.__get_url(target_uri)
+
+            if e.table is not None:
+                # add to file table
+                report.add_to_file_table(target_uri,
+                                         target_url,
+                                         e.table)
+            if e.ucsc_track is not None and target_url is not None:
+                report.add_to_ucsc_track(target_url,
+                                         e.ucsc_track)
+            if e.node is not None:
+                report.add_to_task_graph(e.output_name,
+                                         e.task_name,
+                                         e.shard_idx,
+                                         e.source if target_url is None else target_url,
+                                         e.node,
+                                         e.subgraph)
         # write to html report
         report.save_to_file()
 
+    def __get_shard(self, plan):
+        """Get an ID of a shard if plan is a subset of a full plan.
+        ID is made from targets so that it's the same for a rerun.
+        Entries are compared without targets, which depend on out_dir
+        of a run that made the plan.
+
+        Returns:
+            None if plan has all entries of a full plan.
+        """
+        def get_key(e):
+            return e.task_name, e.output_name, e.source
+
+        keys = set(map(get_key, plan))
+        if all(get_key(e) in keys for e in self.make_plan()):
+            return None
+        targets = sorted(e.target for e in plan if e.target is not None)
+        return hashlib.md5('\n'.join(targets).encode()).hexdigest()[:8]
+
+    def __get_shard_uris(self, fmt, workflow_id, shard):
+        """Get URIs of files written by shards of a plan.
+        For a full plan (shard is None), files of all shards are listed
+        on out_dir. Otherwise, URI of a file for this shard only.
+        """
+        if shard is not None:
+            return [os.path.join(self._out_dir, fmt.format(
+                workflow_id=workflow_id, shard=shard))]
+        prefix, suffix = fmt.split('{shard}')
+        prefix = os.path.join(
+            self._out_dir, prefix.format(workflow_id=workflow_id))
+        try:
+            return [uri for uri in list_uris(prefix) if uri.endswith(suffix)]
+        except Exception:
+            logger.warning(
+                'Failed to find files of shards. {p}'.format(p=prefix),
+                exc_info=True)
+            return []
+
+    def __get_dedup_transfer(self, e, first_targets):
+        """Make a transfer for a plan entry with copy_from.
+        copy_from may not be made in this run (e.g. a subset of a plan).
+        Then copy from its own source if copy_from does not exist.
+        """
+        if e.copy_from not in first_targets:
+            try:
+                exists = get_metadata(
+                    e.copy_from, self._object_index, skip_md5=True).exists
+            except Exception:
+                exists = False
+            if not exists:
+                logger.info(
+                    'File to copy from is not found. Copying from '
+                    'source instead. {c}, {s} -> {t}'.format(
+                        c=e.copy_from, s=e.source, t=e.target))
+                return Transfer(e.source, e.target, TRANSFER_METHOD_COPY)
+        return Transfer(e.copy_from, e.target, e.method)
+
+    def __get_url(self, target_uri):
+        """Get a public/presigned/mapped URL of a file if possible.
+        None if not possible.
+        """
+        u = AutoURI(target_uri)
+
+        if isinstance(u, GCSURI):
+            if self._public_gcs:
+                return u.get_public_url()
+
+            elif self._use_presigned_url_gcs:
+                return u.get_presigned_url(
+                    duration=self._duration_presigned_url_gcs,
+                    private_key_file=self._gcp_private_key)
+
+        elif isinstance(u, S3URI):
+            if self._use_presigned_url_s3:
+                return u.get_presigned_url(
+                    duration=self._duration_presigned_url_s3)
+
+        elif isinstance(u, AbsPath):
+            if self._map_path_to_url:
+                return u.get_mapped_url(
+                    map_path_to_url=self._map_path_to_url)
+        return None
+
     @staticmethod
     def __interpret_inline_exp(s, full_path, shard_idx):
         """Interpret inline expression in output defition JSON
@@ -3,8 +3,6 @@ import os
 from autouri import AutoURI
 from base64 import b64encode
 from copy import deepcopy
-from graphviz import Source
-from graphviz.backend import ExecutableNotFound
 
 
 logger = logging.getLogger(__name__)
@@ -86,6 +84,10 @@ class CrooHtmlReportTaskGraph(object):
             fnc_href=fnc_href,
             fnc_subgraph=fnc_subgraph,
             template=self._template_d)
+        # graphviz is imported only when a task graph is actually rendered
+        from graphviz import Source
+        from graphviz.backend import ExecutableNotFound
+
         # temporary dot, svg from graphviz.Source.render
         tmp_dot = '_tmp_.dot'
 
@@ -8,7 +8,6 @@ Author:
 """
 
 import copy
-from caper.dict_tool import dict_to_dot_str
 
 
 class DAG(object):
@@ -17,12 +16,28 @@ class DAG(object):
     Args:
         fnc_is_parent(n1, n2):
             function to check if n1 is a parent of n2.
+            can be None if fnc_keys_as_parent and fnc_keys_as_child are defined.
         fnc_hash (optional):
             hash function to hash a node.
             this is useful when a node has a mutable object
                 so that node itself is not hashable
         nodes (optional):
             list of nodes to be added to graph.
+        fnc_keys_as_parent(n) (optional):
+            function to get an iterable of hashable keys that
+            children of a node n look up to find n.
+        fnc_keys_as_child(n) (optional):
+            function to get an iterable of hashable keys that
+            a node n looks up to find its parents.
+            If both fnc_keys_as_parent and fnc_keys_as_child are defined then
+            links are made by looking up these keys in an index
+            instead of calling fnc_is_parent against all nodes in graph.
+            n1 is a parent of n2 if and only if
+            fnc_keys_as_parent(n1) and fnc_keys_as_child(n2) share any key.
+        indexed_attrs (optional):
+            tuple of names of nodes' attributes to be indexed.
+            Nodes can be found by these attributes in O(matches)
+            with find_nodes_by_attrs().
 
     Member variables:
         self._nodes:
@@ -31,13 +46,34 @@ class DAG(object):
             { h: set([h_parent1, h_parent2, ...]) } where h = hash of a node.
         self._children:
             { h: set([h_parent1, h_parent2, ...]) } where h = hash of a node.
+        self._parent_index:
+            { key: set([h1, h2, ...]) } where key is from fnc_keys_as_parent.
+        self._child_index:
+            { key: set([h1, h2, ...]) } where key is from fnc_keys_as_child.
+        self._attr_index:
+            { attr: { val: { h1: None, h2: None, ...} } } for each attr in
+            indexed_attrs. dict is used instead of set to keep order of nodes.
     """
-    def __init__(self, fnc_is_parent, fnc_hash=None, nodes=None):
+    def __init__(self, fnc_is_parent, fnc_hash=None, nodes=None,
+                 fnc_keys_as_parent=None, fnc_keys_as_child=None,
+                 indexed_attrs=None):
         self._fnc_is_parent = fnc_is_parent
         self._fnc_hash = fnc_hash
+        self._fnc_keys_as_parent = fnc_keys_as_parent
+        self._fnc_keys_as_child = fnc_keys_as_child
+        self._use_index = fnc_keys_as_parent is not None \
+            and fnc_keys_as_child is not None
+        if not self._use_index and fnc_is_parent is None:
+            raise ValueError(
+                'Define fnc_is_parent or both fnc_keys_as_parent and '
+                'fnc_keys_as_child.')
         self._nodes = {}
         self._parents = {}
         self._children = {}
+        self._parent_index = {}
+        self._child_index = {}
+        self._indexed_attrs = tuple(indexed_attrs) if indexed_attrs else ()
+        self._attr_index = {attr: {} for attr in self._indexed_attrs}
         if nodes is not None:
             for n in nodes:
                 self.add_node(n)
@@ -46,8 +82,79 @@ class DAG(object):
     def from_dag(cls, dag):
         """Copy constructor for DAG.
         """
-        return cls(is_parent=dag._is_parent, fnc_hash=dag._fnc_hash,
-                   nodes=copy.copy(dag._nodes))
+        return cls(fnc_is_parent=dag._fnc_is_parent, fnc_hash=dag._fnc_hash,
+                   nodes=list(dag._nodes.values()),
+                   fnc_keys_as_parent=dag._fnc_keys_as_parent,
+                   fnc_keys_as_child=dag._fnc_keys_as_child,
+                   indexed_attrs=dag._indexed_attrs)
+
+    @classmethod
+    def from_nodes(cls, nodes, fnc_is_parent=None, fnc_hash=None,
+                   fnc_keys_as_parent=None, fnc_keys_as_child=None,
+                   indexed_attrs=None, check_cycle=False):
+        """Construct a DAG with nodes added in bulk.
+        See add_nodes() for details.
+        """
+        dag = cls(fnc_is_parent=fnc_is_parent, fnc_hash=fnc_hash,
+                  fnc_keys_as_parent=fnc_keys_as_parent,
+                  fnc_keys_as_child=fnc_keys_as_child,
+                  indexed_attrs=indexed_attrs)
+        dag.add_nodes(nodes, check_cycle=check_cycle)
+        return dag
+
+    @classmethod
+    def from_edges(cls, nodes, edges, fnc_is_parent=None, fnc_hash=None,
+                   fnc_keys_as_parent=None, fnc_keys_as_child=None,
+                   indexed_attrs=None):
+        """Construct a DAG with nodes and already known links.
+        Links are not searched for (e.g. restoring a DAG from edges
+        exported by to_edges()). Other arguments are used for nodes
+        added later.
+
+        Args:
+            nodes:
+                list of unique nodes.
+            edges:
+                iterable of (i, j) where nodes[i] is a parent of nodes[j].
+        """
+        dag = cls(fnc_is_parent=fnc_is_parent, fnc_hash=fnc_hash,
+                  fnc_keys_as_parent=fnc_keys_as_parent,
+                  fnc_keys_as_child=fnc_keys_as_child,
+                  indexed_attrs=indexed_attrs)
+        hs = []
+        for n in nodes:
+            h = dag.hash_node(n)
+            hs.append(h)
+            dag._nodes[h] = n
+            dag._parents[h] = set()
+            dag._children[h] = set()
+            dag.__index_attrs(h, n)
+            if dag._use_index:
+                dag.__index_keys(h, n)
+        for i, j in edges:
+            dag._children[hs[i]].add(hs[j])
+            dag._parents[hs[j]].add(hs[i])
+        return dag
+
+    def to_edges(self):
+        """Export all nodes and links with positional indices of nodes.
+        Hash of a node can be different in another Python process
+        (e.g. hash of str) but positional indices are not.
+
+        Returns:
+            (nodes, edges) where nodes is [n] and edges is [(i, j)]
+            and nodes[i] is a parent of nodes[j].
+        """
+        nodes = []
+        ids = {}
+        for h, n in self.get_nodes():
+            ids[h] = len(nodes)
+            nodes.append(n)
+        edges = []
+        for h, i in ids.items():
+            for h_child in self.get_children(h):
+                edges.append((i, ids[h_child]))
+        return nodes, edges
 
     def __str__(self):
         """to String.
@@ -130,10 +237,12 @@ class DAG(object):
                 a0 -> a1 -> b1 -> b2;
             }
         """
+        from caper.dict_tool import dict_to_dot_str
+
         d = copy.deepcopy(template) if template is not None else {}
 
         formatted_nodes = []
-        for h, n in self._nodes.items():
+        for h, n in self.get_nodes():
             # wrap hash string
             quoted_h = '"' + str(h) + '"'
             format = fnc_node_format(n)
@@ -157,29 +266,56 @@ class DAG(object):
             quoted_h = '"' + str(h) + '"'
             d['{k} {v}'.format(k=quoted_h, v=format)] = None
 
-        # scan from root to leaf to find children
-        # among candidates in formatted_nodes only
+        # find nearest formatted descendants of each formatted node.
+        # hidden (not formatted) nodes in between are skipped.
+        # each node is visited only once and its result is memoized.
+        formatted = set(h for h, _ in formatted_nodes)
+        nearest = {}
 
-        def deepfind_child(h, candidates, depth=0):
-            """DFS to find any close children in candidates.
+        def find_nearest_formatted(h_start):
+            """Iterative post-order DFS to find nearest formatted descendants
+            of a node. nearest[h] is a set of hashes of formatted descendants
+            that can be reached from h only through hidden nodes.
             This doesn't visit the same branch if a child is found
             but still visits other branches to find other close children
             """
-            result = []
-            if h not in self._children:
-                return result
-            for h_child in self._children[h]:
-                if h_child in candidates:
-                    result.append(h_child)
-                else:
-                    result.extend(deepfind_child(h_child, candidates))
-            return result
+            stack = [h_start]
+            expanded = set()
+            while stack:
+                h = stack[-1]
+                if h in nearest:
+                    stack.pop()
+                    continue
+                children = self.get_children(h)
+                if h not in expanded:
+                    expanded.add(h)
+                    pending = [h_child for h_child in children
+                               if h_child not in formatted
+                               and h_child not in nearest
+                               and h_child not in expanded]
+                    if pending:
+                        stack.extend(pending)
+                        continue
+                stack.pop()
+                if len(children) == 1:
+                    h_child, = children
+                    if h_child not in formatted:
+                        # share a set with a single hidden child
+                        nearest[h] = nearest.get(h_child, frozenset())
+                        continue
+                result = set()
+                for h_child in children:
+                    if h_child in formatted:
+                        result.add(h_child)
+                    else:
+                        result.update(nearest.get(h_child, ()))
+                nearest[h] = result
 
         # construct a parent-to-child map within formatted_nodes
         for h, format in formatted_nodes:
             quoted_h = '"' + str(h) + '"'
-            children = deepfind_child(h, [i for i, _ in formatted_nodes])
-            for h_child in children:
+            find_nearest_formatted(h)
+            for h_child in nearest[h]:
                 quoted_h_child = '"' + str(h_child) + '"'
                 d['{h1} -> {h2}'.format(h1=quoted_h, h2=quoted_h_child)] = None
 
@@ -198,11 +334,41 @@ class DAG(object):
             [(h, n)] where h is a hash of a matched node n
         """
         result = []
-        for h, n in self._nodes.items():
+        for h, n in self.get_nodes():
             if fnc_cond(n):
                 result.append((h, n))
         return result
 
+    def find_nodes_by_attrs(self, **attrs):
+        """Find a list of nodes by matching attributes.
+        Attributes must be indexed (indexed_attrs).
+        This is O(matches) since only nodes in the smallest
+        matching index are checked.
+
+        For example,
+            dag.find_nodes_by_attrs(type='task', task_name='atac.align')
+
+        Returns:
+            [(h, n)] where h is a hash of a matched node n
+        """
+        candidates = None
+        for attr, val in attrs.items():
+            if attr not in self._attr_index:
+                raise ValueError(
+                    'Attribute is not indexed: {}.'.format(attr))
+            hs = self._attr_index[attr].get(val, ())
+            if candidates is None or len(hs) < len(candidates):
+                candidates = hs
+        if candidates is None:
+            return list(self.get_nodes())
+
+        result = []
+        for h in candidates:
+            n = self.get_node(h)
+            if all(getattr(n, attr) == val for attr, val in attrs.items()):
+                result.append((h, n))
+        return result
+
     def get_nodes(self):
         """Get a list of all nodes
 
@@ -211,22 +377,71 @@ class DAG(object):
         """
         return self._nodes.items()
 
+    def get_node(self, h):
+        """Get a node by hash. None if not found.
+        """
+        return self._nodes.get(h)
+
+    def get_parents(self, h):
+        """Get hashes of parents of a node.
+        """
+        return self._parents.get(h, ())
+
+    def get_children(self, h):
+        """Get hashes of children of a node.
+        """
+        return self._children.get(h, ())
+
     def rm_node(self, h, recursive=False):
         """Remove a node based on hash.
+        Only links of the node's parents/children are updated.
 
         Args:
             h: hash of a node.
             recursive: remove all children nodes recursively.
         """
-        self._nodes.pop(h, None)
-        self._parents.pop(h, None)
-        self._children.pop(h, None)
-        for _, v in self._parents.items():
-            if h in v:
-                v.remove(h)
-        for _, v in self._children.items():
-            if h in v:
-                v.remove(h)
+        if h not in self._nodes:
+            return
+        if recursive:
+            hs = self.find_descendants(h)
+            hs.add(h)
+            self.rm_nodes(hs)
+        else:
+            self.rm_nodes((h,))
+
+    def rm_nodes(self, hs):
+        """Remove multiple nodes at once based on hashes.
+        Links between removed nodes are not updated one by one.
+        Only links of remaining parents/children of removed nodes are updated.
+
+        Args:
+            hs: iterable of hashes of nodes.
+        """
+        hs = set(h for h in hs if h in self._nodes)
+        for h in hs:
+            self.__unindex_node(h, self._nodes.pop(h))
+            for h_ in self._parents.pop(h):
+                if h_ not in hs:
+                    self._children[h_].discard(h)
+            for h_ in self._children.pop(h):
+                if h_ not in hs:
+                    self._parents[h_].discard(h)
+
+    def find_descendants(self, h):
+        """Find all descendants of a node (BFS).
+
+        Returns:
+            set([h_descendant1, h_descendant2, ...]) not including h itself.
+        """
+        result = set()
+        queue = [h]
+        while queue:
+            for h_child in self.get_children(queue.pop()):
+                if h_child not in result:
+                    result.add(h_child)
+                    queue.append(h_child)
+        result.discard(h)
+        return result
 
     def add_node(self, n):
         """Add a node to graph.
@@ -235,24 +450,16 @@ class DAG(object):
         h = self.hash_node(n)
 
         if h in self._nodes:
-            # remove all links to n in parents graph
-            for h_ in self._parents:
-                if h == h_:
-                    continue
-                parents = self._parents[h_]
-                if h in parents:
-                    parents.remove(h)
-            # remove all links to n in children graph
-            for h_ in self._children:
-                if h == h_:
-                    continue
-                children = self._children[h_]
-                if h in children:
-                    children.remove(h)
+            self.__unlink_node(h)
 
         self._parents[h] = set()
         self._children[h] = set()
         self._nodes[h] = n
+        self.__index_attrs(h, n)
+
+        if self._use_index:
+            self.__link_node_by_index(h, n)
+            return
 
         # update links in graph
         for h_ in self._nodes:
@@ -269,3 +476,176 @@ class DAG(object):
             elif p_:
                 self._parents[h].add(h_)
                 self._children[h_].add(h)
+
+    def add_nodes(self, nodes, check_cycle=False):
+        """Add multiple nodes to graph at once.
+        All nodes are added to graph first and then links are resolved
+        in a single pass. This is much faster than calling add_node()
+        for each node since graph is not relinked per node.
+
+        Unlike add_node(), a cyclic link is not detected unless
+        check_cycle is True.
+
+        Args:
+            nodes:
+                iterable of nodes to be added to graph.
+                If there are nodes with the same hash then the last one is taken.
+            check_cycle:
+                Check if graph has any cycle after adding nodes.
+                ValueError is raised if a cycle is found.
+        """
+        new_nodes = {}
+        for n in nodes:
+            new_nodes[self.hash_node(n)] = n
+
+        for h, n in new_nodes.items():
+            if h in self._nodes:
+                self.__unlink_node(h)
+            self._parents[h] = set()
+            self._children[h] = set()
+            self._nodes[h] = n
+            self.__index_attrs(h, n)
+
+        if self._use_index:
+            keys = {}
+            for h, n in new_nodes.items():
+                keys[h] = self.__index_keys(h, n)
+
+            for h, (keys_as_parent, keys_as_child) in keys.items():
+                # links from any parent to a new node
+                for key in keys_as_child:
+                    for h_ in self._parent_index.get(key, ()):
+                        if h_ != h:
+                            self._parents[h].add(h_)
+                            self._children[h_].add(h)
+                # links from a new node to an existing child
+                # links to new children are already made above
+                for key in keys_as_parent:
+                    for h_ in self._child_index.get(key, ()):
+                        if h_ not in new_nodes:
+                            self._children[h].add(h_)
+                            self._parents[h_].add(h)
+        else:
+            for h, n in new_nodes.items():
+                for h_, n_ in self._nodes.items():
+                    if h == h_:
+                        continue
+                    if self._fnc_is_parent(n_, n):
+                        self._parents[h].add(h_)
+                        self._children[h_].add(h)
+                    if h_ not in new_nodes and self._fnc_is_parent(n, n_):
+                        self._children[h].add(h_)
+                        self._parents[h_].add(h)
+
+        if check_cycle:
+            self.topological_sort()
+
+    def topological_sort(self):
+        """Sort all nodes in topological order (Kahn's algorithm).
+
+        Returns:
+            [h] where h is a hash of a node. A parent always comes before
+            its children.
+        Raises:
+            ValueError if graph has a cycle.
+        """
+        in_degree = {h: len(v) for h, v in self._parents.items()}
+        queue = [h for h, d in in_degree.items() if d == 0]
+        result = []
+        while queue:
+            h = queue.pop()
+            result.append(h)
+            for h_child in self._children[h]:
+                in_degree[h_child] -= 1
+                if in_degree[h_child] == 0:
+                    queue.append(h_child)
+        if len(result) != len(self._nodes):
+            raise ValueError('Detected a cyclic link in DAG.')
+        return result
+
+    def __unlink_node(self, h):
+        """Remove all links to a node in graph and its keys from indices.
+        Node itself is kept in graph.
+        """
+        # remove links to n in its parents' children
+        for h_ in self._parents[h]:
+            if h != h_:
+                self._children[h_].discard(h)
+        # remove links to n in its children's parents
+        for h_ in self._children[h]:
+            if h != h_:
+                self._parents[h_].discard(h)
+        self.__unindex_node(h, self._nodes[h])
+
+    def __link_node_by_index(self, h, n):
+        """Link a node to its parents/children by looking up keys in
+        indices and then add the node's own keys to indices.
+        """
+        keys_as_parent, keys_as_child = self.__index_keys(h, n)
+
+        parents = set()
+        for key in keys_as_child:
+            if key in self._parent_index:
+                parents.update(self._parent_index[key])
+        children = set()
+        for key in keys_as_parent:
+            if key in self._child_index:
+                children.update(self._child_index[key])
+        parents.discard(h)
+        children.discard(h)
+        if not parents.isdisjoint(children):
+            raise ValueError('Detected a cyclic link in DAG.')
+
+        for h_ in parents:
+            self._children[h_].add(h)
+        for h_ in children:
+            self._parents[h_].add(h)
+        self._parents[h].update(parents)
+        self._children[h].update(children)
+
+    def __index_keys(self, h, n):
+        """Add a node's keys to indices.
+
+        Returns:
+            (keys_as_parent, keys_as_child) of a node
+        """
+        keys_as_parent = set(self._fnc_keys_as_parent(n))
+        keys_as_child = set(self._fnc_keys_as_child(n))
+        for key in keys_as_parent:
+            self._parent_index.setdefault(key, set()).add(h)
+        for key in keys_as_child:
+            self._child_index.setdefault(key, set()).add(h)
+        return keys_as_parent, keys_as_child
+
+    def __index_attrs(self, h, n):
+        """Add a node to attribute indices.
+        """
+        for attr in self._indexed_attrs:
+            self._attr_index[attr].setdefault(
+                getattr(n, attr), {})[h] = None
+
+    def __unindex_node(self, h, n):
+        """Remove a node's keys and attributes from indices.
+        """
+        for attr in self._indexed_attrs:
+            index = self._attr_index[attr]
+            val = getattr(n, attr)
+            hs = index.get(val)
+            if hs is not None:
+                hs.pop(h, None)
+                if not hs:
+                    del index[val]
+        if not self._use_index:
+            return
+        for key in self._fnc_keys_as_parent(n):
+            hs = self._parent_index.get(key)
+            if hs is not None:
+                hs.discard(h)
+                if not hs:
+                    del self._parent_index[key]
+        for key in self._fnc_keys_as_child(n):
+            hs = self._child_index.get(key)
+            if hs is not None:
+                hs.discard(h)
+                if not hs:
+                    del self._child_index[key]
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""Pluggable JSON decoder for croo.
+Uses a fast JSON decoder (orjson, ujson) if installed.
+Otherwise falls back to Python's built-in json module.
+Python's json module is also used for a document that a fast decoder
+rejects but Python's json accepts (e.g. NaN, Infinity, integers > 64 bits).
+Compressed JSON files (gzip, bzip2, xz, zstd) are decompressed on the fly.
+
+Author:
+    Jin Lee (leepc12@gmail.com) at ENCODE-DCC
+"""
+
+import bz2
+import gzip
+import importlib
+import json
+import logging
+import lzma
+
+
+logger = logging.getLogger(__name__)
+
+# in order of preference
+JSON_BACKENDS = ('orjson', 'ujson', 'json')
+JSON_BACKEND_AUTO = 'auto'
+
+MAGIC_GZIP = b'\x1f\x8b'
+MAGIC_BZIP2 = b'BZh'
+MAGIC_XZ = b'\xfd7zXZ\x00'
+MAGIC_ZSTD = b'\x28\xb5\x2f\xfd'
+
+_backend = None
+_loads = None
+
+
+def get_available_backends():
+    """Get names of installed JSON backends in order of preference.
+    """
+    result = []
+    for name in JSON_BACKENDS:
+        try:
+            importlib.import_module(name)
+            result.append(name)
+        except ImportError:
+            pass
+    return result
+
+
+def set_backend(name=JSON_BACKEND_AUTO):
+    """Choose a JSON backend.
+
+    Args:
+        name:
+            One of JSON_BACKENDS or "auto".
+            "auto" picks the first installed one in JSON_BACKENDS.
+    Raises:
+        ImportError if backend is not installed.
+    """
+    global _backend, _loads
+
+    if name == JSON_BACKEND_AUTO:
+        name = get_available_backends()[0]
+    elif name not in JSON_BACKENDS:
+        raise ValueError('Unsupported JSON backend: {}.'.format(name))
+
+    module = importlib.import_module(name)
+    _backend = name
+    _loads = module.loads
+    logger.debug('JSON backend: {}'.format(name))
+
+
+def get_backend():
+    if _backend is None:
+        set_backend()
+    return _backend
+
+
+def loads(s):
+    """Decode a JSON str or bytes with the chosen backend.
+    Key order of JSON objects is kept in all backends.
+    Falls back to Python's json if a fast backend fails to decode it.
+    """
+    if _loads is None:
+        set_backend()
+    if _loads is json.loads:
+        return _loads(s)
+    try:
+        return _loads(s)
+    except ValueError:
+        logger.debug(
+            'JSON backend {b} failed to decode JSON. '
+            'Trying with json.'.format(b=_backend),
+            exc_info=True)
+        return json.loads(s)
+
+
+def open_file(f):
+    """Open a file as a binary stream.
+    Compressed file is detected by magic bytes (not by extension) and
+    decompressed on the fly without writing an uncompressed copy to disk.
+    Supported formats: gzip, bzip2, xz and zstd (requires zstandard).
+    """
+    with open(f, 'rb') as fp:
+        magic = fp.read(len(MAGIC_XZ))
+
+    if magic.startswith(MAGIC_GZIP):
+        return gzip.open(f, 'rb')
+    elif magic.startswith(MAGIC_BZIP2):
+        return bz2.open(f, 'rb')
+    elif magic.startswith(MAGIC_XZ):
+        return lzma.open(f, 'rb')
+    elif magic.startswith(MAGIC_ZSTD):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(
+                'Reading a zstd-compressed file requires zstandard. '
+                'Install it with "pip install zstandard". {f}'.format(f=f))
+        return zstandard.ZstdDecompressor().stream_reader(open(f, 'rb'))
+    return open(f, 'rb')
+
+
+def load_file(f):
+    """Decode a (possibly compressed) JSON file with the chosen backend.
+    File is read as bytes to avoid a UTF-8 decoding pass for fast backends.
+    """
+    with open_file(f) as fp:
+        return loads(fp.read())
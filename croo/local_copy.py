@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""Local-to-local file copy with kernel-side copies.
+Data is copied by kernel (copy_file_range or sendfile) without
+going through Python-level buffers. A large file is split into ranges
+and they are copied in parallel.
+
+Author:
+    Jin Lee (leepc12@gmail.com) at ENCODE-DCC
+"""
+
+import errno
+import os
+import shutil
+import stat
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+# a file larger than this is split into ranges of this size
+CHUNK_SIZE = 1024 * 1024 * 1024
+# max number of threads to copy ranges of a file
+NUM_THREADS = 4
+# buffer size for a fallback pread/pwrite copy
+BUFFER_SIZE = 8 * 1024 * 1024
+
+# errors of copy_file_range/sendfile meaning "not supported here"
+ERRNOS_NOT_SUPPORTED = (
+    errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP)
+
+
+def copy_range(fd_src, fd_dst, offset, count):
+    """Copy count bytes at offset of fd_src to the same offset of fd_dst.
+    Tries copy_file_range (Linux >= 4.5, Python >= 3.8) and then sendfile.
+    Falls back to pread/pwrite if both are not supported.
+    """
+    end = offset + count
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while offset < end:
+                n = os.copy_file_range(
+                    fd_src, fd_dst, end - offset, offset, offset)
+                if n == 0:
+                    break
+                offset += n
+            if offset >= end:
+                return
+        except OSError as e:
+            if e.errno not in ERRNOS_NOT_SUPPORTED:
+                raise
+
+    if hasattr(os, 'sendfile'):
+        try:
+            # sendfile writes at fd_dst's current position
+            os.lseek(fd_dst, offset, os.SEEK_SET)
+            while offset < end:
+                n = os.sendfile(fd_dst, fd_src, offset, end - offset)
+                if n == 0:
+                    break
+                offset += n
+            if offset >= end:
+                return
+        except OSError as e:
+            if e.errno not in ERRNOS_NOT_SUPPORTED:
+                raise
+
+    while offset < end:
+        buf = os.pread(fd_src, min(BUFFER_SIZE, end - offset), offset)
+        if not buf:
+            break
+        os.pwrite(fd_dst, buf, offset)
+        offset += len(buf)
+
+    if offset < end:
+        raise IOError(
+            'Source file is truncated while copying. '
+            'offset={o}, expected={e}'.format(o=offset, e=end))
+
+
+def is_quick_equal(source, target):
+    """Check if target is a copy of source made by copy_file()
+    with the same size/mtime. No data is read.
+    Target must be a regular file (not a soft link to source).
+    """
+    try:
+        st_src = os.stat(source)
+        st_dst = os.lstat(target)
+    except OSError:
+        return False
+    return stat.S_ISREG(st_dst.st_mode) and \
+        st_src.st_size == st_dst.st_size and \
+        st_src.st_mtime_ns == st_dst.st_mtime_ns
+
+
+def copy_file(source, target, chunk_size=CHUNK_SIZE, num_threads=NUM_THREADS):
+    """Copy a local file to a local target.
+    File is written to a temporary file next to target first and then moved
+    to target so that target is never partially written.
+    Permission bits and mtime are copied too.
+
+    Args:
+        chunk_size:
+            Size of a range copied by a thread.
+        num_threads:
+            Max number of threads to copy ranges in parallel.
+    """
+    size = os.path.getsize(source)
+    os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+    tmp = '{}.croo_tmp.{}'.format(target, threading.get_ident())
+
+    # each range opens its own file descriptors for thread-safety
+    def copy_one(offset):
+        with open(source, 'rb') as fsrc, open(tmp, 'r+b') as fdst:
+            copy_range(
+                fsrc.fileno(), fdst.fileno(),
+                offset, min(chunk_size, size - offset))
+
+    try:
+        with open(tmp, 'wb') as fp:
+            fp.truncate(size)
+
+        offsets = range(0, size, chunk_size)
+        if num_threads <= 1 or len(offsets) <= 1:
+            for offset in offsets:
+                copy_one(offset)
+        else:
+            with ThreadPoolExecutor(
+                    max_workers=min(num_threads, len(offsets))) as executor:
+                for _ in executor.map(copy_one, offsets):
+                    pass
+
+        shutil.copystat(source, tmp)
+        os.replace(tmp, target)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
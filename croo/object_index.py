@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""ObjectIndex: in-memory index of objects on cloud buckets.
+Each prefix is listed once (1 request per 1000 objects) instead of
+probing each object individually (1 request per object).
+
+Author:
+    Jin Lee (leepc12@gmail.com) at ENCODE-DCC
+"""
+
+import base64
+import binascii
+import glob
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from autouri import AutoURI, GCSURI, S3URI
+from . import cloud_copy
+
+
+logger = logging.getLogger(__name__)
+
+
+# same fields as autouri's URIMetadata with crc32c (GCS only) in hex
+ObjectMetadata = namedtuple(
+    'ObjectMetadata', ('exists', 'mtime', 'size', 'md5', 'crc32c'),
+    defaults=(None,))
+MISSING = ObjectMetadata(exists=False, mtime=None, size=None, md5=None)
+
+
+def get_metadata(uri, index=None, skip_md5=False):
+    """Get metadata of a file from index if possible.
+    Otherwise, get it from storage with AutoURI.get_metadata().
+    """
+    if index is not None:
+        m = index.get(uri)
+        if m is not None:
+            return m
+    # a client of autouri is cached per thread_id
+    u = AutoURI(uri, thread_id=threading.get_ident())
+    return u.get_metadata(skip_md5=skip_md5)
+
+
+def list_gcs_prefix(bucket, prefix):
+    for blob in cloud_copy.get_gcs_client().list_blobs(bucket, prefix=prefix):
+        md5, crc32c = None, None
+        if blob.md5_hash:
+            md5 = binascii.hexlify(base64.b64decode(blob.md5_hash)).decode()
+        if blob.crc32c:
+            crc32c = binascii.hexlify(base64.b64decode(blob.crc32c)).decode()
+        yield blob.name, ObjectMetadata(
+            exists=True,
+            mtime=blob.updated.timestamp() if blob.updated else None,
+            size=blob.size,
+            md5=md5,
+            crc32c=crc32c)
+
+
+def list_s3_prefix(bucket, prefix):
+    paginator = cloud_copy.get_s3_client().get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', ()):
+            # ETag is md5 only for an object not uploaded with multipart
+            etag = obj.get('ETag', '').strip('"')
+            yield obj['Key'], ObjectMetadata(
+                exists=True,
+                mtime=obj['LastModified'].timestamp(),
+                size=obj['Size'],
+                md5=etag if len(etag) == 32 and '-' not in etag else None)
+
+
+def list_uris(prefix):
+    """List URIs of files starting with prefix.
+    Prefix can be a local path or a URI on gs:// or s3:// buckets.
+    """
+    if prefix.startswith(('gs://', 's3://')):
+        scheme = prefix.split('://', 1)[0]
+        bucket, key = cloud_copy.split_bucket_key(prefix)
+        fnc = list_gcs_prefix if scheme == 'gs' else list_s3_prefix
+        return sorted(
+            '{}://{}/{}'.format(scheme, bucket, k) for k, _ in fnc(bucket, key))
+    return sorted(glob.glob(glob.escape(prefix) + '*'))
+
+
+class ObjectIndex(object):
+    """Index of objects under listed prefixes of gs:// and s3:// buckets.
+    get() returns:
+        ObjectMetadata for a listed object.
+        MISSING if object is not found under a listed prefix.
+        None if unknown (local file, not listed or discarded).
+    An object written after listing should be discarded with discard().
+
+    Args:
+        num_threads:
+            Number of threads to list prefixes in parallel.
+    """
+    def __init__(self, num_threads=1):
+        self._num_threads = num_threads
+        self._objects = {}
+        # { (scheme, bucket): [prefix] }
+        self._prefixes = {}
+        self._discarded = set()
+        self._lock = threading.Lock()
+
+    def add(self, uris, by_call_dir=False):
+        """List prefixes of URIs on cloud buckets not listed yet.
+        One prefix (common directory of all URIs) is listed per bucket.
+        Bucket root is never listed. If URIs have no common directory,
+        they are grouped by top-level directory and a common directory
+        of each group is listed instead (URIs on bucket root are not listed).
+        Add sources and targets separately so that they have their own
+        prefixes. Other URIs (e.g. local paths) are ignored.
+
+        Args:
+            by_call_dir:
+                Group URIs by Cromwell's call directory (call-*/) and
+                list a prefix per group instead. Common directory of
+                Cromwell's outputs is usually a workflow's root and
+                listing it walks all intermediate files of all tasks.
+                URIs not in a call directory are not listed.
+        """
+        keys = {}
+        for uri in uris:
+            if uri is None or self.__is_listed(uri):
+                continue
+            u = AutoURI(uri)
+            if isinstance(u, (GCSURI, S3URI)):
+                scheme = uri.split('://', 1)[0]
+                bucket, key = cloud_copy.split_bucket_key(uri)
+                keys.setdefault((scheme, bucket), []).append(key)
+
+        jobs = []
+        for (scheme, bucket), ks in keys.items():
+            if by_call_dir:
+                groups = {}
+                for k in ks:
+                    groups.setdefault(
+                        ObjectIndex.__get_call_dir(k), []).append(k)
+                groups.pop('', None)
+                prefixes = [
+                    ObjectIndex.__get_common_dir(g) for g in groups.values()]
+            else:
+                prefixes = ObjectIndex.__get_prefixes(ks)
+            # a prefix under another one is already listed there
+            last = None
+            for prefix in sorted(prefixes):
+                if last is not None and prefix.startswith(last):
+                    continue
+                jobs.append((scheme, bucket, prefix))
+                last = prefix
+
+        def list_prefix(job):
+            scheme, bucket, prefix = job
+            fnc = list_gcs_prefix if scheme == 'gs' else list_s3_prefix
+            try:
+                objects = {
+                    '{}://{}/{}'.format(scheme, bucket, key): m
+                    for key, m in fnc(bucket, prefix)}
+            except Exception:
+                # objects under this prefix will be probed individually
+                logger.warning(
+                    'Failed to list objects on {s}://{b}/{p}'.format(
+                        s=scheme, b=bucket, p=prefix),
+                    exc_info=True)
+                return
+            with self._lock:
+                self._objects.update(objects)
+                self._prefixes.setdefault((scheme, bucket), []).append(prefix)
+            logger.info(
+                'Listed {n} object(s) on {s}://{b}/{p}'.format(
+                    n=len(objects), s=scheme, b=bucket, p=prefix))
+
+        if not jobs:
+            return
+        with ThreadPoolExecutor(
+                max_workers=max(1, min(self._num_threads, len(jobs)))) as executor:
+            for _ in executor.map(list_prefix, jobs):
+                pass
+
+    def get(self, uri):
+        with self._lock:
+            if uri in self._discarded:
+                return None
+            m = self._objects.get(uri)
+        if m is not None:
+            return m
+        if self.__is_listed(uri):
+            return MISSING
+        return None
+
+    def discard(self, uri):
+        """Forget an object (e.g. after it's written).
+        """
+        with self._lock:
+            self._discarded.add(uri)
+
+    def __is_listed(self, uri):
+        if '://' not in uri:
+            return False
+        scheme, path = uri.split('://', 1)
+        if '/' not in path:
+            return False
+        bucket, key = path.split('/', 1)
+        with self._lock:
+            prefixes = self._prefixes.get((scheme, bucket), ())
+            return any(key.startswith(prefix) for prefix in prefixes)
+
+    @staticmethod
+    def __get_prefixes(keys):
+        """Common directory of keys. Common directory of each group of keys
+        (grouped by top-level directory) if keys have no common directory.
+        """
+        prefix = ObjectIndex.__get_common_dir(keys)
+        if prefix:
+            return [prefix]
+        groups = {}
+        for k in keys:
+            if '/' in k:
+                groups.setdefault(k.split('/', 1)[0], []).append(k)
+        return [ObjectIndex.__get_common_dir(g) for g in groups.values()]
+
+    @staticmethod
+    def __get_call_dir(key):
+        """Deepest Cromwell's call directory (call-*/) of a key.
+        e.g. a call of a sub-workflow. Empty string if not found.
+        """
+        dirs = key.split('/')[:-1]
+        for i in range(len(dirs) - 1, -1, -1):
+            if dirs[i].startswith('call-'):
+                return '/'.join(dirs[:i + 1]) + '/'
+        return ''
+
+    @staticmethod
+    def __get_common_dir(keys):
+        """Longest common directory (ending with /) of keys.
+        Empty string for a bucket root.
+        """
+        first, last = min(keys), max(keys)
+        n = 0
+        while n < min(len(first), len(last)) and first[n] == last[n]:
+            n += 1
+        return first[:n].rsplit('/', 1)[0] + '/' if '/' in first[:n] else ''
@@ -0,0 +1,748 @@
+#!/usr/bin/env python3
+"""TransferEngine: executes file transfers for Croo.
+Files (Cromwell's original outputs) are linked/copied to
+output directory/bucket with a bounded thread pool.
+
+Author:
+    Jin Lee (leepc12@gmail.com) at ENCODE-DCC
+"""
+
+import json
+import logging
+import os
+import stat
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from autouri import AutoURI, AbsPath
+from . import cloud_copy
+from . import json_backend
+from . import local_copy
+from .object_index import ObjectIndex, get_metadata
+
+
+logger = logging.getLogger(__name__)
+
+_fallback_lock = threading.Lock()
+
+
+Transfer = namedtuple('Transfer', ('source', 'target', 'method'))
+TransferResult = namedtuple('TransferResult', ('target_uri', 'error'))
+# identity of a source file. mtime is updated time for cloud buckets.
+SourceIdentity = namedtuple('SourceIdentity', ('size', 'mtime'))
+# checksums of an organized file. crc32c (hex) is for GCS only.
+Checksum = namedtuple('Checksum', ('path', 'size', 'mtime', 'md5', 'crc32c'))
+
+TRANSFER_METHOD_LINK = 'link'
+TRANSFER_METHOD_COPY = 'copy'
+TRANSFER_METHOD_HARDLINK = 'hardlink'
+TRANSFER_METHOD_REFLINK = 'reflink'
+TRANSFER_METHODS = (
+    TRANSFER_METHOD_LINK, TRANSFER_METHOD_COPY,
+    TRANSFER_METHOD_HARDLINK, TRANSFER_METHOD_REFLINK)
+
+# ioctl request code to clone a file on Linux (btrfs, XFS, ...)
+FICLONE = 0x40049409
+
+
+def hard_link(source, target):
+    """Hard-link source to target. Existing target is replaced atomically.
+    It's a no-op if target is already a hard link to source
+    (not a soft link to it).
+    """
+    try:
+        st_src = os.stat(source)
+        st_dst = os.lstat(target)
+        if not os.path.islink(target) and \
+                (st_src.st_dev, st_src.st_ino) == (st_dst.st_dev, st_dst.st_ino):
+            return
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp = '{}.croo_tmp.{}'.format(target, threading.get_ident())
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    os.link(source, tmp)
+    try:
+        os.replace(tmp, target)
+    except Exception:
+        os.remove(tmp)
+        raise
+
+
+def reflink(source, target):
+    """Make a copy-on-write clone of source on target with FICLONE ioctl.
+    No data is copied. Existing target is replaced atomically.
+
+    Raises:
+        OSError if filesystem does not support it
+        (e.g. not on Linux, not btrfs/XFS or on different filesystems).
+    """
+    import fcntl
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp = '{}.croo_tmp.{}'.format(target, threading.get_ident())
+    try:
+        with open(source, 'rb') as fsrc, open(tmp, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        os.replace(tmp, target)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def is_local_transfer(source, target):
+    return isinstance(AutoURI(source), AbsPath) and \
+        isinstance(AutoURI(target), AbsPath)
+
+
+def is_referenced_only(t):
+    """Check if a transfer just references its source (nothing is
+    transferred). It's a link on (or from/to) cloud buckets.
+    """
+    return t.method == TRANSFER_METHOD_LINK and \
+        not is_local_transfer(t.source, t.target)
+
+
+def log_fallback(method, source, target, e, fallbacks=None):
+    """Log a fallback of a link method to copy.
+    Only the first fallback of each method is logged at warning
+    (e.g. a whole run on a filesystem without reflink). Others at debug.
+
+    Args:
+        fallbacks:
+            Set of methods already fallen back in a run.
+            Every fallback is logged at warning if it's None.
+    """
+    with _fallback_lock:
+        first = fallbacks is None or method not in fallbacks
+        if fallbacks is not None:
+            fallbacks.add(method)
+    msg = 'Failed to {m} a file. Copying it instead. {s} -> {t}. {e}'.format(
+        m=method, s=source, t=target, e=e)
+    if first:
+        logger.warning(
+            msg + ' Other files failed to {m} are logged at debug '
+            'level.'.format(m=method))
+    else:
+        logger.debug(msg)
+
+
+def transfer_file(source, target, method, no_checksum=False, index=None,
+                  make_md5_file=True, checksums=None, fallbacks=None,
+                  quick_local_copy=False):
+    """Transfer a file.
+
+    Args:
+        method:
+            link: soft-link if both source and target are on local storage.
+                Otherwise, source is just referenced (no transfer).
+            copy: copy with autouri (make_md5_file is passed to it).
+                See quick_local_copy for a local-to-local copy.
+                Cloud-to-cloud copy is done without local staging
+                (see cloud_copy).
+            hardlink: hard-link if both source and target are on local storage.
+                Otherwise (or on different filesystems), copy.
+            reflink: copy-on-write clone if both source and target are on
+                local storage and filesystem supports it. Otherwise, copy.
+        index:
+            ObjectIndex of cloud buckets. Used instead of probing
+            target/source on cloud buckets before copying.
+        make_md5_file:
+            Let autouri write an .md5 file next to target.
+        checksums:
+            ChecksumManifest of a previous run. Copy from a cloud bucket
+            is skipped if source's md5 matches target's md5 in it.
+        fallbacks:
+            Set of methods already fallen back to copy in a run.
+            See log_fallback().
+        quick_local_copy:
+            Local-to-local copy is done by kernel (see local_copy) without
+            autouri's lock and skipped if target is a regular file with
+            the same size/mtime as source. No .md5 file is written for it
+            and no data is read to calculate md5.
+            Only for a run with a manifest or checksums of its own.
+    Returns:
+        URI of a transferred file.
+        It is source itself if file is not transferred.
+    """
+    au = AutoURI(source, thread_id=threading.get_ident())
+    if method not in TRANSFER_METHODS:
+        raise ValueError('Unsupported transfer method: {}.'.format(method))
+
+    is_local = is_local_transfer(source, target)
+    if method == TRANSFER_METHOD_LINK:
+        if is_local:
+            au.soft_link(target, force=True)
+            return target
+        return source
+
+    elif method == TRANSFER_METHOD_HARDLINK and is_local:
+        try:
+            hard_link(source, target)
+            return target
+        except OSError as e:
+            log_fallback(method, source, target, e, fallbacks)
+
+    elif method == TRANSFER_METHOD_REFLINK and is_local:
+        try:
+            reflink(source, target)
+            return target
+        except (OSError, ImportError) as e:
+            log_fallback(method, source, target, e, fallbacks)
+
+    if checksums is not None and not no_checksum and \
+            checksums.is_same_file(source, target, index):
+        return target
+    if is_local and quick_local_copy:
+        if no_checksum or not local_copy.is_quick_equal(source, target):
+            local_copy.copy_file(source, target)
+        return target
+    if index is not None and not no_checksum:
+        m = index.get(target)
+        if m is not None and not m.exists:
+            # nothing to compare with
+            no_checksum = True
+    if cloud_copy.is_cloud_to_cloud(source, target):
+        return cloud_copy.copy_object(
+            source, target, no_checksum=no_checksum, index=index)
+    return au.cp(
+        target, no_checksum=no_checksum, make_md5_file=make_md5_file)
+
+
+class TransferJournal(object):
+    """Append-only journal of completed transfers.
+    Each line is a JSON object with source, target, method, target_uri,
+    size/mtime of source (if already known) and timestamp.
+    A restarted run replays it to skip transfers already completed.
+
+    A transfer is written to the journal only after it's completed
+    so that an interrupted transfer is never skipped.
+    A truncated last line (e.g. killed while writing it) is ignored.
+
+    Args:
+        journal_file:
+            Local path for a journal file.
+    """
+    def __init__(self, journal_file):
+        self._journal_file = journal_file
+        self._done = {}
+        self._lock = threading.Lock()
+        self._fp = None
+        self._need_newline = False
+
+        if os.path.exists(journal_file):
+            with open(journal_file) as fp:
+                for line in fp:
+                    self._need_newline = not line.endswith('\n')
+                    try:
+                        d = json.loads(line)
+                        key = (d['source'], d['target'], d['method'])
+                        self._done[key] = d['target_uri']
+                    except (ValueError, KeyError):
+                        logger.debug(
+                            'Ignored an invalid line in journal. {f}'.format(
+                                f=journal_file))
+            logger.info(
+                'Found {n} completed transfer(s) in journal. {f}'.format(
+                    n=len(self._done), f=journal_file))
+
+    def __len__(self):
+        return len(self._done)
+
+    def get_done(self, t):
+        """Find a completed transfer.
+
+        Returns:
+            URI of a transferred file if t is already completed.
+            Otherwise None.
+        """
+        return self._done.get((t.source, t.target, t.method))
+
+    def record(self, t, target_uri, identity=None):
+        """Append a completed transfer to journal.
+        No request is made to get metadata of files.
+
+        Args:
+            identity:
+                SourceIdentity of source if already known.
+                It's just for a record and not used for replaying.
+        """
+        line = json.dumps({
+            'source': t.source,
+            'target': t.target,
+            'method': t.method,
+            'target_uri': target_uri,
+            'size': None if identity is None else identity.size,
+            'mtime': None if identity is None else identity.mtime,
+            'timestamp': time.time()}) + '\n'
+
+        with self._lock:
+            if self._fp is None:
+                os.makedirs(
+                    os.path.dirname(os.path.abspath(self._journal_file)),
+                    exist_ok=True)
+                self._fp = open(self._journal_file, 'a')
+                if self._need_newline:
+                    # terminate a truncated line not to corrupt a new one
+                    self._fp.write('\n')
+            self._fp.write(line)
+            self._fp.flush()
+            self._done[(t.source, t.target, t.method)] = target_uri
+
+    def close(self):
+        with self._lock:
+            if self._fp is not None:
+                self._fp.close()
+                self._fp = None
+
+    def remove(self):
+        """Close and remove journal file.
+        """
+        self.close()
+        if os.path.exists(self._journal_file):
+            os.remove(self._journal_file)
+        self._done = {}
+
+
+def get_source_identity(source, index=None):
+    """Get size/mtime of a source file without calculating md5.
+    It's a stat for a local file and a metadata request (or a look-up in
+    index) for a cloud object.
+
+    Returns:
+        SourceIdentity. None if not available.
+    """
+    try:
+        m = get_metadata(source, index, skip_md5=True)
+        if not m.exists:
+            return None
+        return SourceIdentity(size=m.size, mtime=m.mtime)
+    except Exception:
+        logger.debug(
+            'Failed to get size/mtime of a file. {f}'.format(f=source),
+            exc_info=True)
+        return None
+
+
+def get_content_key(source, index=None):
+    """Get a key to find files with the same contents without reading them.
+    Device/inode for a local file (e.g. hard-linked by Cromwell's call-caching)
+    and size/md5 in metadata for a cloud object.
+
+    Returns:
+        Hashable key. None if not available.
+    """
+    try:
+        u = AutoURI(source)
+        if isinstance(u, AbsPath):
+            st = os.stat(source)
+            return 'inode', st.st_dev, st.st_ino
+        m = get_metadata(source, index)
+        if m.exists and m.md5 is not None:
+            return 'md5', m.size, m.md5
+    except Exception:
+        logger.debug(
+            'Failed to get metadata of a file. {f}'.format(f=source),
+            exc_info=True)
+    return None
+
+
+class TransferManifest(object):
+    """Manifest of files transferred in previous runs.
+    Each transfer is stored with its source's identity (size and mtime).
+    A transfer is unchanged if its source has the same identity as
+    in the manifest and its target is still there
+    so that it can be skipped without md5 checking.
+
+    Args:
+        entries:
+            list of dicts with source, target, method, target_uri,
+            size and mtime. Entries from a previous run.
+    """
+    VERSION = 1
+
+    def __init__(self, entries=None):
+        self._old = {}
+        self._new = {}
+        self._lock = threading.Lock()
+        for d in entries or ():
+            key = (d['source'], d['target'], d['method'])
+            self._old[key] = (
+                SourceIdentity(size=d['size'], mtime=d['mtime']),
+                d['target_uri'])
+
+    @classmethod
+    def load(cls, manifest_uri, tmp_dir=None):
+        """Load a manifest JSON file written by to_json_str().
+        An empty manifest is returned if the file does not exist
+        or is invalid.
+        """
+        try:
+            u = AutoURI(manifest_uri, thread_id=threading.get_ident())
+            if not u.exists:
+                return cls()
+            d = json_backend.load_file(u.localize_on(tmp_dir))
+            if d.get('version') != TransferManifest.VERSION:
+                return cls()
+            manifest = cls(d['files'])
+            logger.info(
+                'Found {n} transferred file(s) in manifest. {f}'.format(
+                    n=len(manifest._old), f=manifest_uri))
+            return manifest
+        except Exception:
+            logger.warning(
+                'Failed to read a manifest. All files will be transferred '
+                'again. {f}'.format(f=manifest_uri),
+                exc_info=True)
+            return cls()
+
+    def get_unchanged(self, t, identity, index=None):
+        """Find an unchanged transfer.
+
+        Args:
+            index:
+                ObjectIndex to look up a target on cloud buckets.
+        Returns:
+            URI of a transferred file if source of t has the same identity as
+            in the manifest and the file still exists with the same size
+            (or is still a soft link to source). Otherwise None.
+        """
+        if identity is None:
+            return None
+        old = self._old.get((t.source, t.target, t.method))
+        if old is None or old[0] != identity:
+            return None
+        target_uri = old[1]
+        if target_uri == t.source:
+            # source itself is referenced
+            return target_uri
+        try:
+            if isinstance(AutoURI(target_uri), AbsPath):
+                if t.method == TRANSFER_METHOD_LINK:
+                    if not os.path.islink(target_uri) or \
+                            os.readlink(target_uri) != t.source:
+                        return None
+                else:
+                    st = os.lstat(target_uri)
+                    if not stat.S_ISREG(st.st_mode) or \
+                            st.st_size != identity.size:
+                        return None
+            else:
+                m = get_metadata(target_uri, index, skip_md5=True)
+                if not m.exists or m.size != identity.size:
+                    return None
+        except OSError:
+            return None
+        return target_uri
+
+    def record(self, t, identity, target_uri):
+        """Record a transfer (either done or skipped) in this run.
+        Transfer without a source's identity is not recorded.
+        """
+        if identity is None:
+            return
+        with self._lock:
+            self._new[(t.source, t.target, t.method)] = (identity, target_uri)
+
+    def merge(self, other):
+        """Add old transfers of another manifest (e.g. of a shard of a plan).
+        They replace old transfers to the same targets.
+        """
+        targets = set(target for _, target, _ in other._old)
+        self._old = {
+            key: v for key, v in self._old.items() if key[1] not in targets}
+        self._old.update(other._old)
+
+    def to_json_str(self, targets=None):
+        """Write transfers recorded in this run as JSON.
+        Old transfers to targets not touched in this run
+        (e.g. a run with a subset of a plan) are kept.
+
+        Args:
+            targets:
+                Write transfers to these targets only (e.g. a shard of a plan).
+        """
+        new_targets = set(target for _, target, _ in self._new)
+        entries = [
+            (key, v) for key, v in self._old.items()
+            if key[1] not in new_targets]
+        entries.extend(self._new.items())
+        if targets is not None:
+            targets = set(targets)
+            entries = [(key, v) for key, v in entries if key[1] in targets]
+        files = []
+        for (source, target, method), (identity, target_uri) in entries:
+            files.append({
+                'source': source,
+                'target': target,
+                'method': method,
+                'target_uri': target_uri,
+                'size': identity.size,
+                'mtime': identity.mtime})
+        return json.dumps(
+            {'version': TransferManifest.VERSION, 'files': files}, indent=4)
+
+
+class ChecksumManifest(object):
+    """Checksums of all organized files in a single TSV file
+    instead of an .md5 file next to each file.
+    Columns are path, size, mtime, md5 and crc32c.
+
+    A checksum of a file is valid while the file has the same size/mtime
+    so that md5 of an unchanged local file is not calculated again.
+
+    Args:
+        checksums:
+            list of Checksum from a previous run.
+    """
+    def __init__(self, checksums=None):
+        self._checksums = {c.path: c for c in checksums or ()}
+
+    def __len__(self):
+        return len(self._checksums)
+
+    @classmethod
+    def load(cls, checksums_uri, tmp_dir=None):
+        """Load a TSV file written by to_tsv_str().
+        An empty one is returned if the file does not exist or is invalid.
+        """
+        try:
+            u = AutoURI(checksums_uri, thread_id=threading.get_ident())
+            if not u.exists:
+                return cls()
+            checksums = []
+            with open(u.localize_on(tmp_dir)) as fp:
+                header = fp.readline().rstrip('\n').split('\t')
+                if tuple(header) != Checksum._fields:
+                    return cls()
+                for line in fp:
+                    path, size, mtime, md5, crc32c = \
+                        line.rstrip('\n').split('\t')
+                    checksums.append(Checksum(
+                        path=path,
+                        size=int(size) if size else None,
+                        mtime=float(mtime) if mtime else None,
+                        md5=md5 or None,
+                        crc32c=crc32c or None))
+            manifest = cls(checksums)
+            logger.info(
+                'Found checksums of {n} file(s). {f}'.format(
+                    n=len(manifest), f=checksums_uri))
+            return manifest
+        except Exception:
+            logger.warning(
+                'Failed to read checksums. {f}'.format(f=checksums_uri),
+                exc_info=True)
+            return cls()
+
+    def get_valid(self, path, m):
+        """Find a checksum of a file still valid for its metadata m.
+
+        Returns:
+            Checksum. None if not found or file has changed.
+        """
+        c = self._checksums.get(path)
+        if c is None or not m.exists or c.size is None or c.mtime is None \
+                or c.size != m.size or c.mtime != m.mtime:
+            return None
+        return c
+
+    def is_same_file(self, source, target, index=None):
+        """Check if target is already a copy of source by md5.
+        Only for a source on cloud buckets (md5 in its metadata).
+        Data is never read to calculate md5 so that it's always False
+        for a local source.
+        """
+        if isinstance(AutoURI(source), AbsPath):
+            return False
+        try:
+            c = self.get_valid(
+                target, get_metadata(target, index, skip_md5=True))
+            if c is None or c.md5 is None:
+                return False
+            return get_metadata(source, index).md5 == c.md5
+        except Exception:
+            logger.debug(
+                'Failed to compare md5 of files. {s} -> {t}'.format(
+                    s=source, t=target),
+                exc_info=True)
+            return False
+
+    def update(self, paths, num_threads=1):
+        """Get checksums of files.
+        Old checksums of other files (e.g. not in a subset of a plan)
+        are kept. md5/crc32c of a cloud object are taken from a listing of its bucket.
+        md5 of a local file is calculated only if it has changed.
+
+        Args:
+            paths:
+                Paths/URIs of organized files.
+            num_threads:
+                Number of threads to calculate md5 of local files.
+        """
+        paths = list(paths)
+        # targets were written after croo's index was made
+        index = ObjectIndex(num_threads=num_threads)
+        index.add(paths)
+
+        def get_checksum(path):
+            m = get_metadata(path, index, skip_md5=True)
+            c = self.get_valid(path, m)
+            if c is not None:
+                return c
+            md5 = m.md5
+            if md5 is None and isinstance(AutoURI(path), AbsPath):
+                md5 = get_metadata(path).md5
+            return Checksum(
+                path=path, size=m.size, mtime=m.mtime, md5=md5,
+                crc32c=getattr(m, 'crc32c', None))
+
+        if num_threads <= 1:
+            checksums = list(map(get_checksum, paths))
+        else:
+            with ThreadPoolExecutor(max_workers=num_threads) as executor:
+                checksums = list(executor.map(get_checksum, paths))
+        self._checksums.update((c.path, c) for c in checksums)
+
+    def merge(self, other):
+        """Add checksums of another one (e.g. of a shard of a plan).
+        """
+        self._checksums.update(other._checksums)
+
+    def to_tsv_str(self, paths=None):
+        """Args:
+            paths:
+                Write checksums of these files only (e.g. a shard of a plan).
+        """
+        lines = ['\t'.join(Checksum._fields)]
+        checksums = self._checksums.values()
+        if paths is not None:
+            paths = set(paths)
+            checksums = [c for c in checksums if c.path in paths]
+        for c in checksums:
+            lines.append('\t'.join(
+                '' if v is None else repr(v) if isinstance(v, float) else str(v)
+                for v in c))
+        return '\n'.join(lines) + '\n'
+
+
+class TransferEngine(object):
+    """Execute transfers with a bounded thread pool.
+
+    Args:
+        num_workers:
+            Number of threads. Transfers are done one by one
+            in the calling thread if it's 1.
+        no_checksum:
+            Skip md5 checking on target. See AutoURI.cp() for details.
+            Transfers in journal/manifest are not skipped either.
+        journal:
+            TransferJournal. Completed transfers are written to it and
+            transfers found in it are skipped.
+        manifest:
+            TransferManifest of a previous run. Transfers with
+            an unchanged source are skipped. All transfers in this run
+            are recorded in it.
+        index:
+            ObjectIndex of sources/targets on cloud buckets.
+        make_md5_file:
+            Write an .md5 file next to a copied file.
+        checksums:
+            ChecksumManifest of a previous run. See transfer_file().
+        quick_local_copy:
+            See transfer_file().
+    """
+    def __init__(self, num_workers=1, no_checksum=False, journal=None,
+                 manifest=None, index=None, make_md5_file=True,
+                 checksums=None, quick_local_copy=False):
+        self._num_workers = num_workers
+        self._no_checksum = no_checksum
+        self._journal = journal
+        self._manifest = manifest
+        self._index = index
+        self._make_md5_file = make_md5_file
+        self._checksums = checksums
+        self._quick_local_copy = quick_local_copy
+        # methods fallen back to copy in this run
+        self._fallbacks = set()
+
+    def run(self, transfers):
+        """Execute all transfers.
+        A failed transfer does not stop others.
+
+        Args:
+            transfers:
+                list of Transfer.
+        Returns:
+            [TransferResult] in the same order as transfers.
+            TransferResult.error is an exception for a failed transfer.
+        """
+        transfers = list(transfers)
+        results = [None] * len(transfers)
+
+        # transfers to the same target are done serially in the original order
+        # so that the last one always wins
+        groups = {}
+        for i, t in enumerate(transfers):
+            groups.setdefault(t.target, []).append(i)
+
+        def run_group(group):
+            # once a file is transferred to a target, all following transfers
+            # to the same target are not skipped
+            force = False
+            for i in group:
+                results[i], transferred = self.__run_one(transfers[i], force)
+                force = force or transferred
+
+        if self._num_workers <= 1 or len(groups) <= 1:
+            for group in groups.values():
+                run_group(group)
+        else:
+            with ThreadPoolExecutor(max_workers=self._num_workers) as executor:
+                for _ in executor.map(run_group, groups.values()):
+                    pass
+        return results
+
+    def __run_one(self, t, force=False):
+        """Returns:
+            Tuple of (TransferResult, whether file is actually transferred).
+        """
+        identity = None
+        if self._manifest is not None and not is_referenced_only(t):
+            identity = get_source_identity(t.source, self._index)
+
+        target_uri = None
+        if not self._no_checksum and not force:
+            if self._manifest is not None:
+                target_uri = self._manifest.get_unchanged(
+                    t, identity, self._index)
+            if target_uri is None and self._journal is not None:
+                target_uri = self._journal.get_done(t)
+        transferred = target_uri is None
+        try:
+            if transferred:
+                try:
+                    target_uri = transfer_file(
+                        t.source, t.target, t.method,
+                        no_checksum=self._no_checksum, index=self._index,
+                        make_md5_file=self._make_md5_file,
+                        checksums=self._checksums,
+                        fallbacks=self._fallbacks,
+                        quick_local_copy=self._quick_local_copy)
+                finally:
+                    # target in index is outdated now
+                    if self._index is not None:
+                        self._index.discard(t.target)
+                if self._journal is not None:
+                    self._journal.record(t, target_uri, identity)
+            if self._manifest is not None:
+                self._manifest.record(t, identity, target_uri)
+            return TransferResult(target_uri=target_uri, error=None), transferred
+        except Exception as e:
+            logger.error(
+                'Failed to {m} a file. {s} -> {t}. {e}'.format(
+                    m=t.method, s=t.source, t=t.target, e=e))
+            return TransferResult(target_uri=None, error=e), transferred
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Transfer plan for Croo.
+A plan is a list of PlanEntry resolved from output definition JSON and
+Cromwell's metadata. It can be written to JSON/TSV (e.g. for a dry run),
+edited/split and then executed later.
+
+Author:
+    Jin Lee (leepc12@gmail.com) at ENCODE-DCC
+"""
+
+import json
+from collections import namedtuple
+from autouri import AutoURI
+from . import json_backend
+
+
+# type:
+#     "input" for pipeline's input (task graph only, no transfer).
+#     "output" for task's output.
+# target, method:
+#     None if there is nothing to transfer ("path" is not defined).
+# table, ucsc_track, node, subgraph:
+#     interpreted annotations for the report. None if not defined.
+# copy_from:
+#     target of another entry with the same contents. File is transferred
+#     from there (after it's done) instead of source. None by default.
+PlanEntry = namedtuple(
+    'PlanEntry',
+    ('type', 'task_name', 'output_name', 'shard_idx',
+     'source', 'target', 'method', 'size',
+     'table', 'ucsc_track', 'node', 'subgraph', 'copy_from'),
+    defaults=(None,))
+
+PLAN_ENTRY_TYPE_INPUT = 'input'
+PLAN_ENTRY_TYPE_OUTPUT = 'output'
+
+
+def plan_to_json_str(plan):
+    """Write a plan as a JSON array of objects.
+    """
+    return json.dumps([e._asdict() for e in plan], indent=4)
+
+
+def plan_to_tsv_str(plan):
+    """Write a plan as a TSV with a header.
+    Empty column means None. shard_idx is comma-delimited.
+    """
+    lines = ['\t'.join(PlanEntry._fields)]
+    for e in plan:
+        cols = []
+        for field, val in zip(PlanEntry._fields, e):
+            if val is None:
+                val = ''
+            elif field == 'shard_idx':
+                val = ','.join(str(i) for i in val)
+            cols.append(str(val))
+        lines.append('\t'.join(cols))
+    return '\n'.join(lines) + '\n'
+
+
+def load_plan_json(plan_json, tmp_dir=None):
+    """Read a plan from a JSON file written by plan_to_json_str().
+    It can be any subset of an original plan.
+
+    Returns:
+        list of PlanEntry
+    """
+    f = AutoURI(plan_json).localize_on(tmp_dir)
+    result = []
+    for d in json_backend.load_file(f):
+        d['shard_idx'] = tuple(d['shard_idx'])
+        result.append(PlanEntry(**d))
+    return result
@@ -8,7 +8,7 @@ setuptools.setup(
     name='croo',
     version='0.4.2.1',
     scripts=['bin/croo'],
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     author='Jin Lee',
     author_email='leepc12@gmail.com',
     description='CRomwell Output Organizer',
@@ -21,5 +21,6 @@ setuptools.setup(
         'License :: OSI Approved :: MIT License',
         'Operating System :: POSIX :: Linux',
     ],
-    install_requires=['autouri>=0.1.2.1', 'graphviz', 'miniwdl', 'caper']
+    install_requires=['autouri>=0.1.2.1', 'graphviz', 'miniwdl', 'caper'],
+    extras_require={'stream': ['ijson'], 'zstd': ['zstandard']}
 )